@@ -4,6 +4,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 
 db = SQLAlchemy()
@@ -16,12 +17,34 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     app.config['UPLOAD_FOLDER'] = os.path.join(app.static_folder, 'uploads')
+    if app.config.get('PROXY_FIX_X_FOR'):
+        # request.remote_addr is the client, not the proxy, so per-IP limits are per client
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
+    from app import dbhealth
+    dbhealth.configure(app)
     db.init_app(app)
+    dbhealth.init_app(app)
     migrate.init_app(app, db)
     login.init_app(app)
     mail.init_app(app)
 
+    from app import lessons, leaderboard, assets, thumbnails, uploads, outbox, notifications, ratelimit, user_cache, profiler, metrics
+    lessons.init_app(app)
+    leaderboard.init_app(app)
+    assets.init_app(app)
+    thumbnails.init_app(app)
+    uploads.init_app(app)
+    outbox.init_app(app)
+    notifications.init_app(app)
+    ratelimit.init_app(app)
+    user_cache.init_app(app)
+    profiler.init_app(app)
+    metrics.init_app(app)
+
+    from app import cli
+    cli.register(app)
+
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
 
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, TextAreaField, IntegerField, SubmitField, SelectField
-from wtforms.validators import DataRequired, ValidationError
+from wtforms.validators import DataRequired, ValidationError, Optional
+from app.scores import score_error
 
 class DayForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired()])
@@ -31,6 +32,13 @@ class AssignmentForm(FlaskForm):
     max_score = IntegerField('Max Score', validators=[DataRequired()])
     submit = SubmitField('Create Assignment')
 
+class TestCaseForm(FlaskForm):
+    name = StringField('Name', validators=[DataRequired()])
+    stdin = TextAreaField('Input (stdin)')
+    expected_output = TextAreaField('Expected Output')
+    points = IntegerField('Points', default=1, validators=[DataRequired()])
+    submit = SubmitField('Add Test Case')
+
 class SubmissionReviewForm(FlaskForm):
     score = IntegerField('Score', validators=[DataRequired()])
     feedback = TextAreaField('Feedback')
@@ -41,8 +49,37 @@ class SubmissionReviewForm(FlaskForm):
         self.assignment = assignment
 
     def validate_score(self, field):
-        if self.assignment and field.data > self.assignment.max_score:
-            raise ValidationError(f'Score cannot exceed the maximum score of {self.assignment.max_score}.')
+        if self.assignment:
+            error = score_error(field.data, self.assignment.max_score)
+            if error:
+                raise ValidationError(error)
+
+class BulkReviewForm(FlaskForm):
+    reviews = TextAreaField('Reviews (one "submission_id,score,feedback" per line)', render_kw={"rows": 12})
+    csv_file = FileField('Or upload a CSV file', validators=[FileAllowed(['csv'], 'CSV files only!')])
+    submit = SubmitField('Apply Reviews')
+
+    def validate_reviews(self, field):
+        if not field.data.strip() and not self.csv_file.data:
+            raise ValidationError('Enter reviews or upload a CSV file.')
+
+class SubmissionFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    assignment_id = SelectField('Assignment', coerce=int, validators=[Optional()])
+    student = StringField('Student', validators=[Optional()])
+    status = SelectField('Status', choices=[('', 'All'), ('ungraded', 'Not Graded'), ('graded', 'Graded')], validators=[Optional()])
+    sort = SelectField('Sort', choices=[('desc', 'Newest first'), ('asc', 'Oldest first')], validators=[Optional()])
+    submit = SubmitField('Filter')
+
+class SimilarityFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    assignment_id = SelectField('Assignment', coerce=int, validators=[Optional()])
+    min_percent = IntegerField('Minimum similarity (%)', default=80, validators=[Optional()])
+    submit = SubmitField('Show')
 
 class UserRoleForm(FlaskForm):
     role = SelectField('Role', choices=[('student', 'Student'), ('teacher', 'Teacher'), ('admin', 'Admin')], validators=[DataRequired()])
@@ -1,12 +1,28 @@
-from flask import render_template, abort, flash, redirect, url_for, request
+from flask import render_template, abort, flash, redirect, url_for, request, jsonify, current_app
 from flask_login import login_required, current_user
 from functools import wraps
+from datetime import datetime
+import csv
+import io
 import os
-from werkzeug.utils import secure_filename
+import time
+from sqlalchemy import and_, or_, false
+from sqlalchemy.orm import joinedload
 from app import db
 from app.admin import bp
-from app.admin.forms import DayForm, LessonForm, NoteForm, AssignmentForm, SubmissionReviewForm, UserRoleForm, ProgramForm
-from app.models import Day, Lesson, Note, Assignment, Submission, User, Program
+from app.admin.forms import DayForm, LessonForm, NoteForm, AssignmentForm, SubmissionReviewForm, UserRoleForm, ProgramForm, SubmissionFilterForm, BulkReviewForm, TestCaseForm, SimilarityFilterForm
+from app.models import Day, Lesson, Note, Assignment, Submission, User, Program, LeaderboardSnapshot, OutboxEmail, Notification, TestCase
+from app.lessons import lesson_cache
+from app.highlighting import highlight_file, highlight_options
+from app.leaderboard import leaderboard_cache
+from app.scores import add_to_total_score, apply_reviews
+from app.notifications import notify, notify_students, review_event, digest_stats
+from app.outbox import delivery_stats
+from app.ratelimit import login_limiter
+from app.user_cache import user_cache
+from app import dbhealth, grader, search, similarity
+from app.profiler import endpoint_stats
+from app.uploads import store_upload, release, schedule_cleanup, UploadError
 
 def admin_required(f):
     @wraps(f)
@@ -22,6 +38,43 @@ def admin_required(f):
 def dashboard():
     return render_template('admin/dashboard.html')
 
+@bp.route('/cache/stats')
+@login_required
+@admin_required
+def cache_stats():
+    return jsonify(lessons=lesson_cache.stats(), login_limiter=login_limiter.stats(), users=user_cache.stats())
+
+@bp.route('/health/db')
+@login_required
+@admin_required
+def db_health():
+    report, ok = dbhealth.health()
+    return jsonify(report), 200 if ok else 503
+
+@bp.route('/profiler')
+@login_required
+@admin_required
+def profiler_summary():
+    return render_template('admin/profiler.html', title='Request Profile', rows=endpoint_stats.summary(),
+                           since=datetime.utcfromtimestamp(endpoint_stats.since),
+                           slow_request_ms=current_app.config.get('SLOW_REQUEST_MS'))
+
+@bp.route('/profiler/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_profiler():
+    endpoint_stats.reset()
+    flash('Request profile has been reset.', 'success')
+    return redirect(url_for('admin.profiler_summary'))
+
+@bp.route('/mail/stats')
+@login_required
+@admin_required
+def mail_stats():
+    queue = dict(db.session.query(OutboxEmail.status, db.func.count(OutboxEmail.id)).group_by(OutboxEmail.status).all())
+    pending_events = Notification.query.filter(Notification.digested_at.is_(None)).count()
+    return jsonify(outbox=delivery_stats.stats(), digests=digest_stats.stats(), queue=queue, pending_events=pending_events)
+
 @bp.route('/days/create', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -44,13 +97,14 @@ def create_lesson():
     if form.validate_on_submit():
         lesson = Lesson(title=form.title.data, day_id=form.day_id.data)
         if form.html_file.data:
-            filename = secure_filename(form.html_file.data.filename)
-            upload_folder = os.path.join('app', 'static', 'uploads')
-            os.makedirs(upload_folder, exist_ok=True)
-            file_path = os.path.join(upload_folder, filename)
-            form.html_file.data.save(file_path)
-            lesson.html_file = f'uploads/{filename}'
+            try:
+                lesson.html_file = store_upload(form.html_file.data, 'lesson')
+            except UploadError as e:
+                db.session.rollback()
+                flash(f'Lesson file rejected: {str(e)}', 'danger')
+                return render_template('admin/create_lesson.html', form=form)
         db.session.add(lesson)
+        search.index_lesson(lesson)
         db.session.commit()
         flash('Lesson created successfully!')
         return redirect(url_for('admin.dashboard'))
@@ -65,13 +119,18 @@ def create_program():
     if form.validate_on_submit():
         program = Program(title=form.title.data, day_id=form.day_id.data)
         if form.python_file.data:
-            filename = secure_filename(form.python_file.data.filename)
-            upload_folder = os.path.join('app', 'static', 'uploads')
-            os.makedirs(upload_folder, exist_ok=True)
-            file_path = os.path.join(upload_folder, filename)
-            form.python_file.data.save(file_path)
-            program.python_file = f'uploads/{filename}'
+            try:
+                program.python_file = store_upload(form.python_file.data, 'program')
+            except UploadError as e:
+                db.session.rollback()
+                flash(f'Program file rejected: {str(e)}', 'danger')
+                return render_template('admin/create_program.html', form=form)
+            try:
+                highlight_file(os.path.join(current_app.static_folder, program.python_file), **highlight_options(current_app))
+            except (OSError, UnicodeDecodeError) as e:
+                current_app.logger.warning(f"Could not pre-highlight {form.python_file.data.filename}: {str(e)}")
         db.session.add(program)
+        search.index_program(program)
         db.session.commit()
         flash('Program created successfully!')
         return redirect(url_for('admin.dashboard'))
@@ -86,6 +145,7 @@ def create_note():
     if form.validate_on_submit():
         note = Note(title=form.title.data, lesson_id=form.lesson_id.data, content=form.content.data)
         db.session.add(note)
+        search.index_note(note)
         db.session.commit()
         flash('Note created successfully!')
         return redirect(url_for('admin.dashboard'))
@@ -99,17 +159,141 @@ def create_assignment():
     if form.validate_on_submit():
         assignment = Assignment(title=form.title.data, description=form.description.data, max_score=form.max_score.data)
         db.session.add(assignment)
+        search.index_assignment(assignment)
+        notify_students('assignment', f'"{assignment.title}" (max score {assignment.max_score}) has been posted.')
         db.session.commit()
         flash('Assignment created successfully!')
         return redirect(url_for('admin.dashboard'))
     return render_template('admin/create_assignment.html', form=form)
 
+@bp.route('/assignments')
+@login_required
+@admin_required
+def list_assignments():
+    test_counts = dict(db.session.query(TestCase.assignment_id, db.func.count(TestCase.id)).group_by(TestCase.assignment_id))
+    assignments = Assignment.query.order_by(Assignment.id.desc()).all()
+    return render_template('admin/list_assignments.html', assignments=assignments, test_counts=test_counts)
+
+@bp.route('/assignments/<int:id>/tests', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def assignment_tests(id):
+    assignment = Assignment.query.get_or_404(id)
+    form = TestCaseForm()
+    if form.validate_on_submit():
+        db.session.add(TestCase(assignment_id=id, name=form.name.data, stdin=form.stdin.data,
+                                expected_output=form.expected_output.data, points=form.points.data))
+        db.session.commit()
+        flash('Test case added.', 'success')
+        return redirect(url_for('admin.assignment_tests', id=id))
+    cases = assignment.test_cases.order_by(TestCase.id).all()
+    return render_template('admin/assignment_tests.html', assignment=assignment, cases=cases, form=form)
+
+@bp.route('/tests/<int:id>/delete', methods=['POST'])
+@login_required
+@admin_required
+def delete_test_case(id):
+    case = TestCase.query.get_or_404(id)
+    db.session.delete(case)
+    db.session.commit()
+    flash(f'Test case "{case.name}" has been deleted.', 'success')
+    return redirect(url_for('admin.assignment_tests', id=case.assignment_id))
+
+@bp.route('/assignments/<int:id>/regrade', methods=['POST'])
+@login_required
+@admin_required
+def regrade_assignment(id):
+    assignment = Assignment.query.get_or_404(id)
+    if not assignment.test_cases.count():
+        flash(f'"{assignment.title}" has no test cases to grade against.', 'warning')
+        return redirect(url_for('admin.assignment_tests', id=id))
+    try:
+        grader.check_sandbox(current_app.config)
+    except grader.SandboxError as e:
+        flash(f'Submissions cannot be graded on this server: {e}', 'danger')
+        return redirect(url_for('admin.assignment_tests', id=id))
+    ids = [row[0] for row in db.session.query(Submission.id).filter_by(assignment_id=id)]
+    grader.schedule(current_app._get_current_object(), ids)
+    flash(f'Re-grading {len(ids)} submission(s) for "{assignment.title}" in the background.', 'success')
+    return redirect(url_for('admin.assignment_tests', id=id))
+
+SUBMISSIONS_PER_PAGE = 50
+
+def _parse_cursor(value):
+    """Decode an ``<submitted_at>_<id>`` keyset cursor."""
+    try:
+        submitted_at, submission_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(submitted_at), int(submission_id)
+    except (AttributeError, ValueError):
+        return None
+
 @bp.route('/submissions')
 @login_required
 @admin_required
 def list_submissions():
-    submissions = Submission.query.all()
-    return render_template('admin/submissions.html', submissions=submissions)
+    form = SubmissionFilterForm(formdata=request.args)
+    form.assignment_id.choices = [(0, 'All')] + [(a.id, a.title) for a in Assignment.query.with_entities(Assignment.id, Assignment.title).order_by(Assignment.id.desc())]
+
+    query = Submission.query.options(joinedload(Submission.author), joinedload(Submission.assignment))
+    if form.assignment_id.data:
+        query = query.filter(Submission.assignment_id == form.assignment_id.data)
+    if form.student.data:
+        user_id = db.session.query(User.id).filter_by(username=form.student.data.strip()).scalar()
+        query = query.filter(Submission.user_id == user_id if user_id else false())
+    if form.status.data == 'graded':
+        query = query.filter(Submission.score.isnot(None))
+    elif form.status.data == 'ungraded':
+        query = query.filter(Submission.score.is_(None))
+
+    # Keyset pagination on (submitted_at, id) keeps every page an index range scan
+    descending = form.sort.data != 'asc'
+    cursor = _parse_cursor(request.args.get('after'))
+    if cursor:
+        submitted_at, submission_id = cursor
+        if descending:
+            query = query.filter(or_(Submission.submitted_at < submitted_at,
+                                     and_(Submission.submitted_at == submitted_at, Submission.id < submission_id)))
+        else:
+            query = query.filter(or_(Submission.submitted_at > submitted_at,
+                                     and_(Submission.submitted_at == submitted_at, Submission.id > submission_id)))
+    if descending:
+        query = query.order_by(Submission.submitted_at.desc(), Submission.id.desc())
+    else:
+        query = query.order_by(Submission.submitted_at.asc(), Submission.id.asc())
+
+    submissions = query.limit(SUBMISSIONS_PER_PAGE + 1).all()
+    next_cursor = None
+    if len(submissions) > SUBMISSIONS_PER_PAGE:
+        submissions = submissions[:SUBMISSIONS_PER_PAGE]
+        last = submissions[-1]
+        next_cursor = f'{last.submitted_at.isoformat()}_{last.id}'
+    filters = {key: value for key, value in request.args.items() if key != 'after' and value}
+    return render_template('admin/submissions.html', submissions=submissions, form=form,
+                           filters=filters, next_cursor=next_cursor, paged=cursor is not None)
+
+@bp.route('/submissions/similarity')
+@login_required
+@admin_required
+def similarity_report():
+    form = SimilarityFilterForm(formdata=request.args)
+    form.assignment_id.choices = [(a.id, a.title) for a in Assignment.query.with_entities(Assignment.id, Assignment.title).order_by(Assignment.id.desc())]
+    if not form.assignment_id.data and form.assignment_id.choices:
+        form.assignment_id.data = form.assignment_id.choices[0][0]
+    min_percent = form.min_percent.data if form.min_percent.data is not None else 80
+    pairs = similarity.report(form.assignment_id.data, min_percent / 100) if form.assignment_id.data else []
+    return render_template('admin/similarity.html', title='Similarity Report', form=form, pairs=pairs,
+                           stored_percent=current_app.config['SIMILARITY_MIN_PERCENT'])
+
+@bp.route('/submissions/similarity/<int:assignment_id>/rebuild', methods=['POST'])
+@login_required
+@admin_required
+def rebuild_similarity(assignment_id):
+    assignment = Assignment.query.get_or_404(assignment_id)
+    indexed, candidates, pairs, seconds = similarity.rebuild(assignment_id)
+    current_app.logger.info(f"Rebuilt similarity index for assignment {assignment_id}: {indexed} submissions, "
+                            f"{candidates} candidate pairs, {pairs} similar pairs in {seconds * 1000:.1f} ms")
+    flash(f'Fingerprinted {indexed} submission(s) for "{assignment.title}": {candidates} candidate pair(s), {pairs} similar.', 'success')
+    return redirect(url_for('admin.similarity_report', assignment_id=assignment_id))
 
 @bp.route('/submissions/<int:id>/review', methods=['GET', 'POST'])
 @login_required
@@ -118,16 +302,25 @@ def review_submission(id):
     submission = Submission.query.get_or_404(id)
     form = SubmissionReviewForm(assignment=submission.assignment)
     if form.validate_on_submit():
-        old_score = submission.score or 0
+        # Lock the submission so concurrent reviews of it are applied one after another
+        submission = Submission.query.filter_by(id=id).with_for_update().populate_existing().one()
+        previous_score = submission.score
+        old_score = previous_score or 0
+        old_feedback = submission.feedback
         
         submission.score = form.score.data
         submission.feedback = form.feedback.data
         
-        score_difference = submission.score - old_score
-        submission.author.total_score = (submission.author.total_score or 0) + score_difference
+        add_to_total_score(submission.user_id, submission.score - old_score)
+        event = review_event(submission.assignment.title, previous_score, submission.score,
+                             submission.assignment.max_score, old_feedback, submission.feedback)
+        if event:
+            notify(submission.user_id, *event)
         
         try:
             db.session.commit()
+            user_cache.invalidate(submission.user_id)
+            leaderboard_cache.record_score(submission.author)
             flash('Submission has been reviewed and score updated.', 'success')
         except Exception as e:
             db.session.rollback()
@@ -138,6 +331,54 @@ def review_submission(id):
         form.feedback.data = submission.feedback
     return render_template('admin/review_submission.html', title='Review Submission', submission=submission, form=form)
 
+def _parse_bulk_reviews(lines, errors):
+    """Turn ``submission_id,score[,feedback]`` CSV rows into review dicts."""
+    reviews = []
+    for line_no, row in enumerate(csv.reader(lines), start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if line_no == 1 and not row[0].strip().isdigit():
+            # Header row
+            continue
+        if len(row) < 2:
+            errors.append((line_no, 'Expected at least submission_id and score.'))
+            continue
+        try:
+            submission_id = int(row[0])
+            score = int(row[1])
+        except ValueError:
+            errors.append((line_no, 'submission_id and score must be whole numbers.'))
+            continue
+        feedback = ','.join(row[2:]).strip() if len(row) > 2 else ''
+        reviews.append({'line': line_no, 'submission_id': submission_id, 'score': score,
+                        'feedback': feedback or None})
+    return reviews
+
+@bp.route('/submissions/bulk_review', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def bulk_review():
+    form = BulkReviewForm()
+    errors = []
+    applied = None
+    if form.validate_on_submit():
+        if form.csv_file.data:
+            text = form.csv_file.data.read().decode('utf-8-sig', errors='replace')
+        else:
+            text = form.reviews.data
+        reviews = _parse_bulk_reviews(io.StringIO(text), errors)
+        try:
+            applied, row_errors = apply_reviews(reviews)
+            errors.extend(row_errors)
+            errors.sort()
+            leaderboard_cache.invalidate()
+            flash(f'{applied} submission(s) reviewed, {len(errors)} row(s) rejected.', 'success' if not errors else 'warning')
+        except Exception as e:
+            db.session.rollback()
+            applied = None
+            flash(f'Error applying reviews: {str(e)}', 'error')
+    return render_template('admin/bulk_review.html', title='Bulk Review', form=form, errors=errors, applied=applied)
+
 @bp.route('/users')
 @login_required
 @admin_required
@@ -158,20 +399,28 @@ def list_days():
 def delete_day(id):
     day = Day.query.get_or_404(id)
     try:
-        # Delete all lessons, programs, notes, assignments related to this day
-        lessons = Lesson.query.filter_by(day_id=id).all()
-        for lesson in lessons:
-            # Delete notes for this lesson
-            Note.query.filter_by(lesson_id=lesson.id).delete()
-            # Delete lesson
-            db.session.delete(lesson)
-        
-        # Delete programs for this day
-        Program.query.filter_by(day_id=id).delete()
+        started = time.perf_counter()
+        lesson_ids = db.select(Lesson.id).where(Lesson.day_id == id)
+        files = [row[0] for row in db.session.query(Lesson.html_file).filter(Lesson.day_id == id)]
+        files += [row[0] for row in db.session.query(Program.python_file).filter(Program.day_id == id)]
+
+        release(files)
+
+        # Search documents go first, while their ids can still be selected
+        search.remove('note', db.select(Note.id).where(Note.lesson_id.in_(lesson_ids)))
+        search.remove('lesson', lesson_ids)
+        search.remove('program', db.select(Program.id).where(Program.day_id == id))
+
+        # Delete notes, lessons and programs for this day with one statement each
+        notes = Note.query.filter(Note.lesson_id.in_(lesson_ids)).delete(synchronize_session=False)
+        lessons = Lesson.query.filter_by(day_id=id).delete(synchronize_session=False)
+        programs = Program.query.filter_by(day_id=id).delete(synchronize_session=False)
         
         # Delete day
         db.session.delete(day)
         db.session.commit()
+        current_app.logger.info(f"Deleted day {id} ({lessons} lessons, {notes} notes, {programs} programs) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        schedule_cleanup(files)
         flash(f'Day "{day.title}" and all related content have been deleted.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -191,12 +440,18 @@ def list_lessons():
 def delete_lesson(id):
     lesson = Lesson.query.get_or_404(id)
     try:
+        started = time.perf_counter()
         # Delete notes for this lesson
-        Note.query.filter_by(lesson_id=id).delete()
+        search.remove('note', db.select(Note.id).where(Note.lesson_id == id))
+        search.remove('lesson', [id])
+        notes = Note.query.filter_by(lesson_id=id).delete(synchronize_session=False)
         
         # Delete the lesson
+        release([lesson.html_file])
         db.session.delete(lesson)
         db.session.commit()
+        current_app.logger.info(f"Deleted lesson {id} ({notes} notes) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        schedule_cleanup([lesson.html_file])
         flash(f'Lesson "{lesson.title}" and all related notes have been deleted.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -216,8 +471,11 @@ def list_programs():
 def delete_program(id):
     program = Program.query.get_or_404(id)
     try:
+        release([program.python_file])
+        search.remove('program', [id])
         db.session.delete(program)
         db.session.commit()
+        schedule_cleanup([program.python_file])
         flash(f'Program "{program.title}" has been deleted.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -237,6 +495,7 @@ def list_notes():
 def delete_note(id):
     note = Note.query.get_or_404(id)
     try:
+        search.remove('note', [id])
         db.session.delete(note)
         db.session.commit()
         flash(f'Note "{note.title}" has been deleted.', 'success')
@@ -254,6 +513,7 @@ def change_user_role(id):
     if form.validate_on_submit():
         user.role = form.role.data
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash(f'Role for {user.username} updated to {user.role}.', 'success')
         return redirect(url_for('admin.list_users'))
     elif request.method == 'GET':
@@ -265,23 +525,35 @@ def change_user_role(id):
 @admin_required
 def reset_app():
     try:
-        # Delete all submissions
-        Submission.query.delete()
-        # Delete all assignments
-        Assignment.query.delete()
-        # Delete all notes
-        Note.query.delete()
-        # Delete all programs
-        Program.query.delete()
-        # Delete all lessons
-        Lesson.query.delete()
-        # Delete all days
-        Day.query.delete()
+        started = time.perf_counter()
+        files = [row[0] for row in db.session.query(Lesson.html_file)]
+        files += [row[0] for row in db.session.query(Program.python_file)]
+        files += [row[0] for row in db.session.query(User.profile_pic).filter(User.role != 'admin', User.profile_pic != 'default.jpg')]
+        release(files)
+
+        # Children before parents, one set-based DELETE per table
+        counts = {}
+        counts.update(similarity.clear())
+        counts['submissions'] = Submission.query.delete(synchronize_session=False)
+        counts['test cases'] = TestCase.query.delete(synchronize_session=False)
+        counts['assignments'] = Assignment.query.delete(synchronize_session=False)
+        counts['notes'] = Note.query.delete(synchronize_session=False)
+        counts['programs'] = Program.query.delete(synchronize_session=False)
+        counts['lessons'] = Lesson.query.delete(synchronize_session=False)
+        counts['days'] = Day.query.delete(synchronize_session=False)
+        counts['snapshots'] = LeaderboardSnapshot.query.delete(synchronize_session=False)
+        counts['notifications'] = Notification.query.delete(synchronize_session=False)
+        counts['search documents'] = search.clear()
         # Delete all non-admin users
-        User.query.filter(User.role != 'admin').delete()
+        counts['users'] = User.query.filter(User.role != 'admin').delete(synchronize_session=False)
         db.session.commit()
+        leaderboard_cache.invalidate()
+        user_cache.clear()
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        current_app.logger.info(f"App reset ({summary}) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        schedule_cleanup(files)
         flash('App has been reset successfully! All data except admin users has been cleared.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error resetting app: {str(e)}', 'error')
-    return redirect(url_for('admin.dashboard'))
\ No newline at end of file
+    return redirect(url_for('admin.dashboard'))
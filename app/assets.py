@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+import threading
+from flask import request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+_CAS_NAME = re.compile(r'^uploads/cas/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+VERSION_LENGTH = 12
+ONE_YEAR = 31536000
+
+
+class AssetManifest:
+    """Maps static filenames to short content hashes.
+
+    Files under ``uploads/cas`` already carry their hash in the name. Other
+    files are hashed once and re-hashed only if their mtime or size changes.
+    """
+
+    def __init__(self):
+        self.static_folder = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def build(self, static_folder, skip=('uploads',)):
+        """Hash every static file outside ``skip`` up front."""
+        self.static_folder = static_folder
+        for root, dirs, files in os.walk(static_folder):
+            if root == static_folder:
+                dirs[:] = [d for d in dirs if d not in skip]
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for name in files:
+                filename = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+                self.version(filename)
+
+    def version(self, filename):
+        """Return the content version for ``filename`` or None if it does not exist."""
+        match = _CAS_NAME.match(filename)
+        if match:
+            return match.group(1)[:VERSION_LENGTH]
+        path = safe_join(self.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self._entries.get(filename)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        hasher = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    hasher.update(chunk)
+        except OSError:
+            return None
+        version = hasher.hexdigest()[:VERSION_LENGTH]
+        with self._lock:
+            self._entries[filename] = (st.st_mtime_ns, st.st_size, version)
+        return version
+
+    def manifest(self):
+        with self._lock:
+            return {filename: entry[2] for filename, entry in self._entries.items()}
+
+
+asset_manifest = AssetManifest()
+
+
+def init_app(app):
+    """Fingerprint ``url_for('static', ...)`` and serve versioned files as immutable."""
+    asset_manifest.build(app.static_folder)
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = asset_manifest.version(values['filename'])
+            if version:
+                values['v'] = version
+
+    def static(filename):
+        version = asset_manifest.version(filename)
+        if version is None:
+            raise NotFound()
+        immutable = request.args.get('v') == version
+        response = send_from_directory(app.static_folder, filename, etag=version,
+                                       max_age=ONE_YEAR if immutable else 0)
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    app.view_functions['static'] = static
@@ -5,6 +5,8 @@ from wtforms.validators import DataRequired, ValidationError, Email, EqualTo
 from app.models import User
 from flask_login import current_user
 
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -19,7 +21,7 @@ class RegistrationForm(FlaskForm):
         'Repeat Password', validators=[DataRequired(), EqualTo('password')])
     role = SelectField('Role', choices=[('', 'Select Role'), ('student', 'Student'), ('admin', 'Admin')], validators=[DataRequired()])
     admin_code = StringField('Admin Code (if Admin)', default='')
-    profile_pic = FileField('Profile Picture (optional)')
+    profile_pic = FileField('Profile Picture (optional)', validators=[FileAllowed(IMAGE_EXTENSIONS, 'Images only!')])
     submit = SubmitField('Register')
 
     def validate_username(self, username):
@@ -41,7 +43,7 @@ class RegistrationForm(FlaskForm):
             raise ValidationError('Invalid admin code.')
 
 class ChangeProfilePicForm(FlaskForm):
-    profile_pic = FileField('New Profile Picture')
+    profile_pic = FileField('New Profile Picture', validators=[FileAllowed(IMAGE_EXTENSIONS, 'Images only!')])
     submit = SubmitField('Update Profile Picture')
 
 class EditProfileForm(FlaskForm):
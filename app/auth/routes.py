@@ -1,13 +1,15 @@
 from flask import render_template, redirect, url_for, flash, request, current_app
 from urllib.parse import urlparse
 from flask_login import login_user, logout_user, current_user
-from app import db, mail
+from app import db
 from app.auth import bp
 from app.auth.forms import LoginForm, RegistrationForm, ChangeProfilePicForm, EditProfileForm, ForgotPasswordForm, ResetPasswordForm
 from app.models import User
-import os
-from werkzeug.utils import secure_filename
-from flask_mail import Message
+from app.uploads import store_upload, upload_name, release, schedule_cleanup
+from app import thumbnails
+from app.outbox import send_email
+from app.ratelimit import login_limiter
+from app.user_cache import user_cache
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -15,10 +17,22 @@ def login():
         return redirect(url_for('student.dashboard'))
     form = LoginForm()
     if form.validate_on_submit():
+        # Throttle before touching the database or hashing anything
+        wait = login_limiter.check(request.remote_addr, form.username.data)
+        if wait:
+            flash(f'Too many login attempts. Please try again in {wait} seconds.', 'danger')
+            response = current_app.make_response((render_template('auth/login.html', title='Sign In', form=form), 429))
+            response.headers['Retry-After'] = str(wait)
+            return response
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password', 'danger')
             return redirect(url_for('auth.login'))
+        login_limiter.succeeded(request.remote_addr, form.username.data)
+        if user.password_needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
+            user_cache.invalidate(user.id)
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or urlparse(next_page).netloc != '':
@@ -41,23 +55,14 @@ def register():
             user = User(username=form.username.data, email=form.email.data, role=form.role.data.lower())
             user.set_password(form.password.data)
             if form.profile_pic.data:
-                file = form.profile_pic.data
-                filename = secure_filename(file.filename)
-                # Truncate filename if too long (keep extension)
-                if len(filename) > 200:
-                    name, ext = os.path.splitext(filename)
-                    filename = name[:200-len(ext)] + ext
-                upload_folder = current_app.config['UPLOAD_FOLDER']
-                os.makedirs(upload_folder, exist_ok=True)
-                file_path = os.path.join(upload_folder, filename)
                 try:
-                    file.save(file_path)
-                    user.profile_pic = filename
+                    user.profile_pic = upload_name(store_upload(form.profile_pic.data, 'profile_pic'))
                     flash('Profile picture uploaded successfully!', 'success')
                 except Exception as e:
                     flash(f'Error uploading profile picture: {str(e)}', 'warning')
             db.session.add(user)
             db.session.commit()
+            thumbnails.schedule(current_app, f'uploads/{user.profile_pic}')
             flash('Congratulations, you are now a registered user!', 'success')
             return redirect(url_for('auth.login'))
         except Exception as e:
@@ -77,22 +82,18 @@ def change_profile_pic():
     form = ChangeProfilePicForm()
     if form.validate_on_submit():
         if form.profile_pic.data:
-            file = form.profile_pic.data
-            filename = secure_filename(file.filename)
-            # Truncate filename if too long (keep extension)
-            if len(filename) > 200:
-                name, ext = os.path.splitext(filename)
-                filename = name[:200-len(ext)] + ext
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            os.makedirs(upload_folder, exist_ok=True)
-            file_path = os.path.join(upload_folder, filename)
             try:
-                file.save(file_path)
-                current_user.profile_pic = filename
+                old_pic = current_user.profile_pic
+                current_user.profile_pic = upload_name(store_upload(form.profile_pic.data, 'profile_pic'))
+                release([old_pic])
                 db.session.commit()
+                user_cache.invalidate(current_user.id)
+                thumbnails.schedule(current_app, f'uploads/{current_user.profile_pic}')
+                schedule_cleanup([old_pic])
                 flash('Profile picture updated successfully!', 'success')
                 return redirect(url_for('student.dashboard'))
             except Exception as e:
+                db.session.rollback()
                 flash(f'Error uploading profile picture: {str(e)}', 'warning')
         else:
             flash('No file selected.', 'warning')
@@ -114,6 +115,7 @@ def edit_profile():
                 current_user.set_password(form.new_password.data)
             
             db.session.commit()
+            user_cache.invalidate(current_user.id)
             flash('Profile updated successfully!', 'success')
             return redirect(url_for('student.dashboard'))
         except Exception as e:
@@ -136,24 +138,15 @@ def send_password_reset_email(user):
         print(f"{reset_url}")
         print(f"{'='*60}\n")
     
-    msg = Message('Password Reset Request',
-                  sender=current_app.config['MAIL_DEFAULT_SENDER'],
-                  recipients=[user.email])
-    msg.body = f'''To reset your password, visit the following link:
+    body = f'''To reset your password, visit the following link:
 {reset_url}
 
 If you did not make this request, simply ignore this email and no changes will be made.
 '''
     
-    try:
-        mail.send(msg)
-        current_app.logger.info(f"Password reset email sent to {user.email}")
-    except Exception as e:
-        # If email fails, log the reset URL for development
-        current_app.logger.info(f"Password reset link for {user.email}: {reset_url}")
-        current_app.logger.warning(f"Email sending failed: {str(e)}")
-        # For development, we can still proceed
-        pass
+    # Delivery (and retrying) happens in the outbox worker, not in this request
+    send_email('Password Reset Request', [user.email], body)
+    current_app.logger.info(f"Password reset email queued for {user.email}")
 
 @bp.route('/forgot_password', methods=['GET', 'POST'])
 def forgot_password():
@@ -187,6 +180,7 @@ def reset_password(token):
     if form.validate_on_submit():
         user.set_password(form.password.data)
         user.clear_reset_token()
+        user_cache.invalidate(user.id)
         flash('Your password has been reset.', 'success')
         return redirect(url_for('auth.login'))
     return render_template('auth/reset_password.html', title='Reset Password', form=form)
\ No newline at end of file
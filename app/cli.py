@@ -0,0 +1,205 @@
+import click
+
+
+def register(app):
+    @app.cli.group()
+    def leaderboard():
+        """Leaderboard maintenance commands."""
+        pass
+
+    @leaderboard.command()
+    def snapshot():
+        """Record every student's current rank (run periodically, e.g. nightly)."""
+        from app.leaderboard import take_snapshot
+        count = take_snapshot()
+        click.echo(f'Recorded {count} leaderboard ranks.')
+
+    @app.cli.group()
+    def scores():
+        """Score consistency commands."""
+        pass
+
+    @scores.command()
+    def check():
+        """Report users whose total_score differs from their submissions."""
+        from app.scores import find_score_drift
+        drift = find_score_drift()
+        for user_id, username, total_score, actual in drift:
+            click.echo(f'{user_id}\t{username}\ttotal_score={total_score}\tsubmissions={actual}')
+        click.echo(f'{len(drift)} user(s) out of sync.')
+        if drift:
+            raise SystemExit(1)
+
+    @scores.command()
+    def recompute():
+        """Recompute every total_score from submission scores."""
+        from app.scores import recompute_total_scores
+        from app.leaderboard import leaderboard_cache
+        count = recompute_total_scores()
+        leaderboard_cache.invalidate()
+        click.echo(f'Updated total_score for {count} user(s).')
+
+    @app.cli.group()
+    def uploads():
+        """Upload store maintenance commands."""
+        pass
+
+    @uploads.command()
+    def dedupe():
+        """Move existing flat uploads into the content-addressed store."""
+        from app.uploads import dedupe_existing_uploads
+        moved, saved = dedupe_existing_uploads()
+        click.echo(f'Repointed {moved} reference(s); saved {saved} bytes.')
+
+    @uploads.command('sync-refcounts')
+    def sync_refcounts():
+        """Recompute reference counts for stored files."""
+        from app.uploads import sync_refcounts
+        sync_refcounts()
+        click.echo('Reference counts updated.')
+
+    @uploads.command()
+    def thumbnails():
+        """Generate missing avatar thumbnails for stored profile pictures."""
+        from app import thumbnails as avatar_thumbnails
+        from app.models import User
+        if avatar_thumbnails.Image is None:
+            raise click.ClickException('Pillow is not installed.')
+        generated = 0
+        for (profile_pic,) in User.query.with_entities(User.profile_pic).distinct():
+            path = f'uploads/{profile_pic}'
+            if avatar_thumbnails.variant_paths(path):
+                avatar_thumbnails.generate(app.static_folder, path)
+                generated += 1
+        click.echo(f'Generated thumbnails for {generated} picture(s).')
+
+    @app.cli.group()
+    def outbox():
+        """Email outbox commands."""
+        pass
+
+    @outbox.command()
+    def status():
+        """Show how many queued emails are in each state."""
+        from app import db
+        from app.models import OutboxEmail
+        counts = db.session.query(OutboxEmail.status, db.func.count(OutboxEmail.id)).group_by(OutboxEmail.status).all()
+        for state, count in sorted(counts):
+            click.echo(f'{state}\t{count}')
+
+    @outbox.command()
+    @click.option('--once', is_flag=True, help='Send everything that is due, then exit.')
+    @click.option('--batch-size', type=int, default=None, help='Emails per SMTP connection.')
+    def work(once, batch_size):
+        """Deliver queued emails (run as a dedicated worker with OUTBOX_WORKER=false)."""
+        import time
+        from app.outbox import drain
+        while True:
+            sent, failed, seconds = drain(app.config, batch_size)
+            if sent or failed:
+                rate = sent / seconds if seconds else 0
+                click.echo(f'Sent {sent}, failed {failed} in {seconds:.2f}s ({rate:.1f}/s).')
+            if once:
+                break
+            time.sleep(app.config['OUTBOX_POLL_INTERVAL'])
+
+    @outbox.command()
+    def digest():
+        """Queue notification digests now instead of waiting for the interval."""
+        from app.notifications import flush_digests
+        emails, events = flush_digests()
+        click.echo(f'Queued {emails} digest(s) covering {events} event(s).')
+
+    @outbox.command()
+    def retry():
+        """Move failed emails back to the queue."""
+        from datetime import datetime
+        from app import db
+        from app.models import OutboxEmail
+        count = (OutboxEmail.query.filter_by(status='failed')
+                 .update({'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+                         synchronize_session=False))
+        db.session.commit()
+        click.echo(f'Requeued {count} email(s).')
+
+    @app.cli.group('search')
+    def search_group():
+        """Full-text search index commands."""
+        pass
+
+    @search_group.command()
+    def reindex():
+        """Rebuild the search index from notes, lessons, programs and assignments."""
+        from app.search import create_index, reindex_all
+        create_index()
+        counts = reindex_all()
+        click.echo('Indexed ' + ', '.join(f'{count} {kind}(s)' for kind, count in counts.items()) + '.')
+
+    @search_group.command('query')
+    @click.argument('words')
+    @click.option('--kind', type=click.Choice(['note', 'lesson', 'program', 'assignment']), default=None)
+    def query_index(words, kind):
+        """Print the first page of results for WORDS and how long the query took."""
+        import time
+        from app.search import find
+        started = time.perf_counter()
+        results, has_next = find(words, kind, per_page=app.config['SEARCH_PER_PAGE'])
+        elapsed = (time.perf_counter() - started) * 1000
+        for result in results:
+            click.echo(f'{result.kind}\t{result.ref_id}\t{result.title.striptags()}')
+        click.echo(f'{len(results)}{"+" if has_next else ""} result(s) in {elapsed:.1f} ms.')
+
+    @app.cli.group('grader')
+    def grader_group():
+        """Auto-grader commands."""
+        pass
+
+    @grader_group.command()
+    @click.argument('assignment_id', type=int)
+    @click.option('--ungraded', is_flag=True, help='Only grade submissions without a score.')
+    @click.option('--workers', type=int, default=None, help='Sandboxes to run at once (default GRADER_WORKERS).')
+    @click.option('--batch-size', type=int, default=None, help='Scores written per transaction.')
+    def regrade(assignment_id, ungraded, workers, batch_size):
+        """Run every submission for ASSIGNMENT_ID against its test cases."""
+        from app import db
+        from app.grader import SandboxError, grade_submissions
+        from app.models import Assignment, Submission
+        assignment = db.session.get(Assignment, assignment_id)
+        if assignment is None:
+            raise click.ClickException(f'Assignment {assignment_id} does not exist.')
+        cases = assignment.test_cases.count()
+        if not cases:
+            raise click.ClickException(f'"{assignment.title}" has no test cases.')
+        if workers:
+            app.config['GRADER_WORKERS'] = workers
+        query = db.session.query(Submission.id).filter_by(assignment_id=assignment_id)
+        if ungraded:
+            query = query.filter(Submission.score.is_(None))
+        ids = [row[0] for row in query]
+        click.echo(f'Grading {len(ids)} submission(s) against {cases} test case(s) '
+                   f'with {app.config["GRADER_WORKERS"]} worker(s)...')
+        try:
+            graded, runs, seconds = grade_submissions(app, ids, batch_size)
+        except SandboxError as e:
+            raise click.ClickException(f'Submissions cannot be graded on this machine: {e}')
+        click.echo(f'Graded {graded} submission(s), {runs} test run(s) in {seconds:.2f}s '
+                   f'({graded / seconds if seconds else 0:.1f} submissions/s, {runs / seconds if seconds else 0:.1f} runs/s).')
+
+    @app.cli.group('similarity')
+    def similarity_group():
+        """Copied-code detection commands."""
+        pass
+
+    @similarity_group.command('rebuild')
+    @click.argument('assignment_id', type=int, required=False)
+    def rebuild_similarity(assignment_id):
+        """Fingerprint submissions and find similar pairs (every assignment by default)."""
+        from app import db
+        from app.models import Assignment
+        from app.similarity import rebuild
+        ids = [assignment_id] if assignment_id else [row[0] for row in db.session.query(Assignment.id).order_by(Assignment.id)]
+        for current in ids:
+            indexed, candidates, pairs, seconds = rebuild(current)
+            rate = indexed / seconds if seconds else 0
+            click.echo(f'Assignment {current}: {indexed} submission(s), {candidates} candidate pair(s), '
+                       f'{pairs} similar, {seconds:.2f}s ({rate:.0f} submissions/s).')
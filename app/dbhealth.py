@@ -0,0 +1,145 @@
+import threading
+import time
+from sqlalchemy import event, exc, text
+from sqlalchemy.pool import QueuePool
+from app import db
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', '5000'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-20000'),
+)
+
+
+class PoolStats:
+    """Counters fed by pool events, per worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.slow_waits = 0
+            self.held_total = 0.0
+            self.held_max = 0.0
+            self.checkins = 0
+
+    def record_wait(self, seconds, slow=0.05):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if seconds >= slow:
+                self.slow_waits += 1
+
+    def record_held(self, seconds):
+        with self._lock:
+            self.checkins += 1
+            self.held_total += seconds
+            self.held_max = max(self.held_max, seconds)
+
+    def add(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else None,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'slow_waits': self.slow_waits,
+                'held_avg_ms': round(self.held_total / self.checkins * 1000, 3) if self.checkins else None,
+                'held_max_ms': round(self.held_max * 1000, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.add('timeouts')
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
+
+
+def configure(app):
+    """Adjust engine options before ``db.init_app`` creates the engine."""
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if 'pool_size' in options and 'poolclass' not in options:
+        options['poolclass'] = TimedQueuePool
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['checked_out_at'] = time.perf_counter()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop('checked_out_at', None)
+    if started is not None:
+        pool_stats.record_held(time.perf_counter() - started)
+
+
+def init_app(app):
+    """Attach pool instrumentation (and SQLite pragmas) to the app's engine."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == 'sqlite' and app.config.get('SQLITE_WAL') and engine.url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    event.listen(engine, 'connect', lambda *args: pool_stats.add('connects'))
+    event.listen(engine, 'invalidate', lambda *args: pool_stats.add('invalidations'))
+    event.listen(engine, 'checkout', _on_checkout)
+    event.listen(engine, 'checkin', _on_checkin)
+
+
+def health():
+    """Pool state and a round-trip check; returns ``(report, ok)``."""
+    engine = db.engine
+    pool = engine.pool
+    report = {'dialect': engine.dialect.name, 'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        report.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+                      overflow=pool.overflow(), max_overflow=pool._max_overflow, timeout=pool.timeout())
+    report['events'] = pool_stats.stats()
+    started = time.perf_counter()
+    try:
+        db.session.execute(text('SELECT 1'))
+        ok = True
+    except exc.SQLAlchemyError as e:
+        db.session.rollback()
+        report['error'] = str(e)
+        ok = False
+    report['ping_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    if engine.dialect.name == 'sqlite':
+        report['journal_mode'] = db.session.execute(text('PRAGMA journal_mode')).scalar() if ok else None
+    return report, ok
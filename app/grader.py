@@ -0,0 +1,337 @@
+import errno
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from markupsafe import escape
+
+# Exit code and stderr prefix the jail uses when it cannot be set up
+SANDBOX_EXIT = 121
+SANDBOX_MARKER = 'grader-sandbox: '
+# Read-only system paths the interpreter needs inside the jail, besides its own prefix
+SYSTEM_PATHS = ('/usr', '/bin', '/lib', '/lib64', '/lib32', '/etc/ld.so.cache')
+
+# Runs first, as the app's user, and builds the jail the submission runs in:
+#   - new mount, pid, network, IPC and UTS namespaces (plus a user namespace
+#     when the app is not root, so no privileges are needed),
+#   - a fresh tmpfs root holding only read-only binds of SYSTEM_PATHS, the
+#     Python prefix and the submission's work directory; no /proc, nothing of the app,
+#   - root switches to GRADER_RUN_AS_UID, then PR_SET_NO_NEW_PRIVS and exec, which
+#     drops every capability gained in the namespaces.
+# Any step that fails exits with SANDBOX_EXIT instead of running the submission.
+JAIL = r'''
+import ctypes, os, resource, signal, sys
+def fail(message):
+    os.write(2, f'%(marker)s{message}\n'.encode())
+    os._exit(%(exit)d)
+try:
+    root, work, cpu, memory, output, uid = sys.argv[1], sys.argv[2], *map(int, sys.argv[3:7])
+    bootstrap, binds = sys.argv[7], sys.argv[8:]
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mount.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p)
+    def check(result, what):
+        if result != 0:
+            fail(f'{what} failed: {os.strerror(ctypes.get_errno())}')
+    def mount(source, target, fstype, flags, data=None):
+        encode = lambda value: value.encode() if value else None
+        check(libc.mount(encode(source), encode(target), encode(fstype), flags, encode(data)), f'mount {target}')
+    RDONLY, NOSUID, NODEV, REMOUNT, BIND, REC, PRIVATE = 1, 2, 4, 32, 4096, 16384, 1 << 18
+    NEWNS, NEWUTS, NEWIPC, NEWUSER, NEWPID, NEWNET = 0x20000, 0x4000000, 0x8000000, 0x10000000, 0x20000000, 0x40000000
+    # statvfs flags that must be kept when remounting a bind inside a user namespace
+    KEEP = ((os.ST_NOEXEC, 8), (os.ST_NOATIME, 1024), (os.ST_NODIRATIME, 2048), (os.ST_RELATIME, 1 << 21), (os.ST_NODEV, NODEV))
+    def remount(target, flags):
+        current = os.statvfs(target).f_flag
+        flags |= sum(flag for st, flag in KEEP if current & st)
+        mount(None, target, None, REMOUNT | BIND | NOSUID | flags)
+
+    outer_uid, outer_gid = os.getuid(), os.getgid()
+    if outer_uid == 0 and uid <= 0:
+        fail('GRADER_RUN_AS_UID must be an unprivileged uid when the app runs as root')
+    check(libc.unshare(NEWNS | NEWPID | NEWNET | NEWIPC | NEWUTS | (NEWUSER if outer_uid else 0)), 'unshare')
+    if outer_uid:
+        for path, line in (('/proc/self/setgroups', 'deny'), ('/proc/self/uid_map', f'{outer_uid} {outer_uid} 1'),
+                           ('/proc/self/gid_map', f'{outer_gid} {outer_gid} 1')):
+            with open(path, 'w') as f:
+                f.write(line)
+    pid = os.fork()
+    if pid:
+        # Only waits, so the grader sees the jailed process's exit status as its own
+        status = os.waitpid(pid, 0)[1]
+        if os.WIFSIGNALED(status):
+            if os.WTERMSIG(status) != signal.SIGKILL:
+                signal.signal(os.WTERMSIG(status), signal.SIG_DFL)
+            os.kill(os.getpid(), os.WTERMSIG(status))
+        os._exit(os.WEXITSTATUS(status))
+
+    mount(None, '/', None, REC | PRIVATE)
+    mount('grader', root, 'tmpfs', NOSUID | NODEV, 'size=1m,mode=755')
+    for path in binds:
+        target = root + path
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), target)
+            continue
+        if os.path.isdir(path):
+            os.makedirs(target, exist_ok=True)
+        else:
+            open(target, 'w').close()
+        mount(path, target, None, BIND | REC)
+        remount(target, RDONLY)
+    os.makedirs(root + '/work')
+    mount(work, root + '/work', None, BIND)
+    remount(root + '/work', NODEV)
+    os.chroot(root)
+    os.chdir('/work')
+    remount('/', RDONLY | NODEV)
+
+    for limit, value in ((resource.RLIMIT_CPU, (cpu, cpu + 1)), (resource.RLIMIT_AS, (memory, memory)),
+                         (resource.RLIMIT_FSIZE, (output, output)), (resource.RLIMIT_NOFILE, (32, 32)),
+                         (resource.RLIMIT_CORE, (0, 0))):
+        resource.setrlimit(limit, value)
+    if outer_uid == 0:
+        os.setgroups([])
+        os.setgid(uid)
+        os.setuid(uid)
+    check(libc.prctl(38, 1, 0, 0, 0), 'PR_SET_NO_NEW_PRIVS')
+    if os.getuid() == 0:
+        fail('refusing to run a submission as root')
+    os.execve(sys.executable, [sys.executable, '-I', '-c', bootstrap, '/work/solution.py'],
+              {'PATH': '/usr/bin:/bin', 'LANG': 'C.UTF-8', 'HOME': '/work', 'TMPDIR': '/work'})
+except Exception as exc:
+    fail(f'{type(exc).__name__}: {exc}')
+''' % {'marker': SANDBOX_MARKER, 'exit': SANDBOX_EXIT}
+
+# Runs the solution inside the jail. The audit hook is a second line of defence
+# only; the jail above is what contains a submission.
+BOOTSTRAP = r'''
+import os, sys
+with open(sys.argv[1], encoding='utf-8') as f:
+    code = compile(f.read(), 'solution.py', 'exec')
+workdir = os.getcwd() + os.sep
+BLOCKED = ('socket.', 'subprocess.', 'os.exec', 'os.spawn', 'os.posix_spawn', 'os.fork', 'os.system',
+           'os.kill', 'os.killpg', 'pty.', 'ctypes.', 'gc.get_', 'sys._current_frames', 'object.__getattr__')
+def guard(event, args, blocked=BLOCKED, workdir=workdir, abspath=os.path.abspath, write_flags=os.O_WRONLY | os.O_RDWR):
+    if event.startswith(blocked):
+        raise PermissionError(f'{event} is not allowed')
+    if event in ('open', 'os.remove', 'os.rename', 'os.rmdir', 'shutil.rmtree') and args and isinstance(args[0], str):
+        writing = event != 'open' or any(c in (args[1] or '') for c in 'wax+') or (args[2] or 0) & write_flags
+        if writing and not abspath(args[0]).startswith(workdir):
+            raise PermissionError(f'writing to {args[0]} is not allowed')
+# The solution runs as a fresh __main__ so it cannot reach this module's names
+main = type(sys)('__main__')
+main.__builtins__ = __builtins__
+sys.modules['__main__'] = main
+sys.argv = ['solution.py']
+sys.addaudithook(guard)
+# Once installed the hook is only reachable through the interpreter, not from Python code
+del guard, BLOCKED
+exec(code, main.__dict__)
+'''
+
+Limits = namedtuple('Limits', 'cpu_seconds wall_seconds memory_bytes output_bytes uid')
+CaseResult = namedtuple('CaseResult', 'name points passed status detail seconds')
+GradeResult = namedtuple('GradeResult', 'submission_id user_id score feedback runs seconds')
+
+_EXCEPTION_RE = re.compile(r'^([A-Za-z_][\w.]*(?:Error|Exception|Exit|Interrupt|Warning))\b')
+
+
+class SandboxError(RuntimeError):
+    """The jail could not be set up, so the submission was not run."""
+
+
+def limits_from_config(config):
+    return Limits(config.get('GRADER_CPU_SECONDS', 2), config.get('GRADER_WALL_SECONDS', 5),
+                  config.get('GRADER_MEMORY_MB', 256) * 1024 * 1024, config.get('GRADER_OUTPUT_LIMIT', 64 * 1024),
+                  config.get('GRADER_RUN_AS_UID', 65534))
+
+
+def _jail_paths():
+    paths = {os.path.realpath(path) for path in (sys.prefix, sys.base_prefix, sys.exec_prefix, sys.base_exec_prefix)}
+    paths.update(path for path in SYSTEM_PATHS if os.path.lexists(path))
+    # A path inside another bind is visible already and could not be created on a read-only mount
+    return sorted(path for path in paths
+                  if not any(path != other and path.startswith(other.rstrip('/') + '/') for other in paths))
+
+
+def normalize_output(value):
+    """Ignore trailing spaces on each line and trailing blank lines."""
+    return '\n'.join(line.rstrip() for line in value.replace('\r\n', '\n').split('\n')).rstrip('\n')
+
+
+def _error_name(errors, returncode):
+    """Only the exception's type: the message and traceback can carry data the program read."""
+    lines = errors.strip().splitlines()
+    match = _EXCEPTION_RE.match(lines[-1]) if lines else None
+    return match.group(1) if match else f'exit code {returncode}'
+
+
+def run_case(code, case, limits):
+    """Run ``code`` once with the case's stdin in a fresh jailed interpreter.
+
+    Raises ``SandboxError`` if the jail cannot be built; the submission is
+    never run without it.
+    """
+    base = tempfile.mkdtemp(prefix='grader-')
+    started = time.perf_counter()
+    try:
+        workdir = os.path.join(base, 'work')
+        os.mkdir(workdir, 0o700)
+        os.mkdir(os.path.join(base, 'root'), 0o700)
+        solution = os.path.join(workdir, 'solution.py')
+        with open(solution, 'w', encoding='utf-8') as f:
+            f.write(code or '')
+        if os.getuid() == 0 and limits.uid > 0:
+            os.chown(workdir, limits.uid, limits.uid)
+            os.chown(solution, limits.uid, limits.uid)
+        with open(os.path.join(base, 'stdout'), 'w+b') as stdout, \
+                open(os.path.join(base, 'stderr'), 'w+b') as stderr:
+            process = subprocess.Popen(
+                [sys.executable, '-I', '-c', JAIL, os.path.join(base, 'root'), workdir, str(limits.cpu_seconds),
+                 str(limits.memory_bytes), str(limits.output_bytes), str(limits.uid), BOOTSTRAP, *_jail_paths()],
+                cwd=base, stdin=subprocess.PIPE, stdout=stdout, stderr=stderr,
+                env={'PATH': '/usr/bin:/bin', 'LANG': 'C.UTF-8'},
+                start_new_session=True, close_fds=True)
+            try:
+                process.communicate((case['stdin'] or '').encode(), timeout=limits.wall_seconds)
+                timed_out = False
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                timed_out = True
+            except BrokenPipeError:
+                # The program exited without reading all of its input
+                process.wait()
+                timed_out = False
+            stdout.seek(0)
+            output = stdout.read(limits.output_bytes).decode('utf-8', 'replace')
+            stderr.seek(0)
+            errors = stderr.read(limits.output_bytes).decode('utf-8', 'replace')
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+    seconds = time.perf_counter() - started
+    returncode = process.returncode
+    if returncode == SANDBOX_EXIT and errors.startswith(SANDBOX_MARKER):
+        raise SandboxError(errors[len(SANDBOX_MARKER):].strip())
+    # Feedback is shown to the student, so it names what went wrong but never echoes
+    # the program's output or the expected output of a hidden case
+    if timed_out or returncode == -signal.SIGXCPU or returncode == -signal.SIGKILL:
+        status, detail = 'time limit exceeded', ''
+    elif returncode == -signal.SIGXFSZ or f'[Errno {errno.EFBIG}]' in errors:
+        status, detail = 'output limit exceeded', ''
+    elif 'MemoryError' in errors:
+        status, detail = 'memory limit exceeded', ''
+    elif returncode != 0:
+        status, detail = 'runtime error', _error_name(errors, returncode)
+    elif normalize_output(output) != normalize_output(case['expected_output'] or ''):
+        status, detail = 'wrong answer', ''
+    else:
+        status, detail = 'passed', ''
+    return CaseResult(case['name'], case['points'], status == 'passed', status, detail, seconds)
+
+
+def check_sandbox(config):
+    """Run a trivial program in the jail; raises ``SandboxError`` if grading cannot work here."""
+    result = run_case('print(1)', {'name': 'sandbox check', 'stdin': '', 'expected_output': '1', 'points': 1},
+                      limits_from_config(config))
+    if not result.passed:
+        raise SandboxError(f'a trivial program failed in the jail: {result.status} {result.detail}'.strip())
+
+
+def grade(submission, cases, max_score, limits):
+    """Run every case against one submission and turn the results into a score and feedback."""
+    started = time.perf_counter()
+    results = [run_case(submission['code_text'], case, limits) for case in cases]
+    total = sum(result.points for result in results)
+    earned = sum(result.points for result in results if result.passed)
+    score = round(max_score * earned / total) if total else 0
+    lines = [f'Passed {sum(result.passed for result in results)}/{len(results)} tests ({earned}/{total} points).']
+    for result in results:
+        # Feedback is rendered as HTML, so every part that came from a case or a program is escaped
+        line = f"{'PASS' if result.passed else 'FAIL'} {escape(result.name)}"
+        if not result.passed:
+            line += f': {result.status}' + (f' ({escape(result.detail)})' if result.detail else '')
+        lines.append(line)
+    return GradeResult(submission['id'], submission['user_id'], score, '\n'.join(lines), len(results),
+                       time.perf_counter() - started)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    # Each job spends its time waiting on a child interpreter, so threads are enough to keep
+    # one sandboxed process per core busy without forking the app
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('GRADER_WORKERS') or os.cpu_count() or 2,
+                                           thread_name_prefix='grader')
+        return _executor
+
+
+def grade_submissions(app, submission_ids, batch_size=None, progress=None):
+    """Grade submissions in parallel, writing scores in batches through ``apply_reviews``.
+
+    Submissions whose assignment has no test cases are skipped. Returns
+    ``(graded, runs, seconds)``; must be called inside an app context.
+    Raises ``SandboxError`` before grading anything if the jail does not work.
+    """
+    from app import db
+    from app.models import Assignment, Submission, TestCase
+    from app.scores import apply_reviews
+    batch_size = batch_size or app.config.get('GRADER_BATCH_SIZE', 100)
+    limits = limits_from_config(app.config)
+    started = time.perf_counter()
+    check_sandbox(app.config)
+    rows = (db.session.query(Submission.id, Submission.user_id, Submission.code_text,
+                             Submission.assignment_id, Assignment.max_score)
+            .join(Assignment, Submission.assignment_id == Assignment.id)
+            .filter(Submission.id.in_(submission_ids))
+            .all())
+    assignment_ids = {row.assignment_id for row in rows}
+    cases = {}
+    for case in (TestCase.query.filter(TestCase.assignment_id.in_(assignment_ids))
+                 .order_by(TestCase.assignment_id, TestCase.id)):
+        cases.setdefault(case.assignment_id, []).append(
+            {'name': case.name, 'stdin': case.stdin, 'expected_output': case.expected_output, 'points': case.points})
+    db.session.rollback()  # nothing is held open while the sandboxes run
+
+    executor = _get_executor(app)
+    futures = [executor.submit(grade, row._asdict(), cases[row.assignment_id], row.max_score or 0, limits)
+               for row in rows if cases.get(row.assignment_id)]
+    graded = runs = 0
+    pending = []
+    for future in as_completed(futures):
+        result = future.result()
+        runs += result.runs
+        pending.append({'line': result.submission_id, 'submission_id': result.submission_id,
+                        'score': result.score, 'feedback': result.feedback})
+        if len(pending) >= batch_size:
+            graded += apply_reviews(pending)[0]
+            pending = []
+        if progress:
+            progress(result)
+    if pending:
+        graded += apply_reviews(pending)[0]
+    return graded, runs, time.perf_counter() - started
+
+
+def schedule(app, submission_ids):
+    """Grade submissions in the background, e.g. right after one is saved."""
+    def run():
+        with app.app_context():
+            try:
+                graded, runs, seconds = grade_submissions(app, submission_ids)
+                app.logger.info(f'Auto-graded {graded} submission(s), {runs} test run(s) in {seconds:.2f}s')
+            except Exception:
+                app.logger.exception(f'Auto-grading {len(submission_ids)} submission(s) failed')
+    threading.Thread(target=run, name='grader-batch', daemon=True).start()
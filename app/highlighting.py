@@ -0,0 +1,74 @@
+import hashlib
+import os
+import threading
+from pygments import highlight
+from pygments.lexers import PythonLexer
+from pygments.formatters import HtmlFormatter
+
+_lexer = PythonLexer()
+_formatters = {}
+_stylesheets = {}
+_lock = threading.Lock()
+
+
+def _formatter(style, css_classes):
+    key = (style, css_classes)
+    formatter = _formatters.get(key)
+    if formatter is None:
+        formatter = HtmlFormatter(style=style, noclasses=not css_classes)
+        with _lock:
+            _formatters[key] = formatter
+    return formatter
+
+
+def artifact_path(source_path, style='monokai', css_classes=True):
+    """Path of the pre-highlighted HTML stored next to a program file."""
+    mode = 'classes' if css_classes else 'inline'
+    return f'{source_path}.{style}.{mode}.html'
+
+
+def highlight_file(source_path, style='monokai', css_classes=True):
+    """Highlight a Python file and persist the HTML next to it."""
+    with open(source_path, 'r', encoding='utf-8') as f:
+        html = highlight(f.read(), _lexer, _formatter(style, css_classes))
+    target = artifact_path(source_path, style, css_classes)
+    tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp, target)
+    except OSError:
+        pass
+    return html
+
+
+def get_highlighted(source_path, style='monokai', css_classes=True):
+    """Return highlighted HTML, regenerating the artifact if missing or stale.
+
+    Raises FileNotFoundError if the program file does not exist.
+    """
+    source_mtime = os.stat(source_path).st_mtime_ns
+    target = artifact_path(source_path, style, css_classes)
+    try:
+        if os.stat(target).st_mtime_ns >= source_mtime:
+            with open(target, 'r', encoding='utf-8') as f:
+                return f.read()
+    except OSError:
+        pass
+    return highlight_file(source_path, style, css_classes)
+
+
+def stylesheet(style='monokai'):
+    """Return (css, version) for class-based highlighting."""
+    cached = _stylesheets.get(style)
+    if cached is None:
+        css = _formatter(style, True).get_style_defs('.highlight')
+        cached = (css, hashlib.sha1(css.encode('utf-8')).hexdigest()[:12])
+        with _lock:
+            _stylesheets[style] = cached
+    return cached
+
+
+def highlight_options(app):
+    return {'style': app.config.get('PYGMENTS_STYLE', 'monokai'),
+            'css_classes': app.config.get('PYGMENTS_CSS_CLASSES', True)}
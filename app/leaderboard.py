@@ -0,0 +1,132 @@
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func, select
+from app import db
+from app.models import User, LeaderboardSnapshot
+
+
+class LeaderboardCache:
+    """Per-worker cache of the top-N students.
+
+    Score changes made by this worker are applied to the cached rows in
+    place; other workers pick them up once ``ttl`` expires.
+    """
+
+    def __init__(self, size=50, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._rows = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def configure(self, size=None, ttl=None):
+        with self._lock:
+            if size is not None:
+                self.size = size
+            if ttl is not None:
+                self.ttl = ttl
+            self._rows = None
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+
+    def top(self):
+        with self._lock:
+            if self._rows is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return list(self._rows)
+        rows = [row._asdict() for row in ranked_users().limit(self.size)]
+        with self._lock:
+            self._rows = rows
+            self._loaded_at = time.monotonic()
+        return list(rows)
+
+    def record_score(self, user):
+        """Apply a changed ``total_score`` for ``user`` to the cached rows."""
+        with self._lock:
+            if self._rows is None:
+                return
+            rows = [row for row in self._rows if row['id'] != user.id]
+            dropped = len(rows) < len(self._rows)
+            if user.role != 'admin':
+                rows.append({'id': user.id, 'username': user.username,
+                             'profile_pic': user.profile_pic, 'total_score': user.total_score or 0})
+            rows.sort(key=lambda row: (-(row['total_score'] or 0), row['id']))
+            if len(rows) > self.size:
+                rows = rows[:self.size]
+            elif dropped and rows and rows[-1]['id'] == user.id and len(rows) == self.size:
+                # A student fell to the bottom of the list; someone outside it may now outrank them
+                self._rows = None
+                return
+            self._rows = rows
+
+
+leaderboard_cache = LeaderboardCache()
+
+
+def init_app(app):
+    leaderboard_cache.configure(size=app.config.get('LEADERBOARD_CACHE_SIZE', 50),
+                                ttl=app.config.get('LEADERBOARD_CACHE_TTL', 60))
+
+
+def ranked_users():
+    """Non-admin users in leaderboard order, backed by ix_user_role_total_score."""
+    return (db.session.query(User.id, User.username, User.profile_pic, User.total_score)
+            .filter(User.role != 'admin')
+            .order_by(User.total_score.desc(), User.id))
+
+
+def _rank_for_score(score):
+    # Competition ranking, like take_snapshot(): one plus the number of students strictly ahead
+    ahead = (db.session.query(func.count(User.id))
+             .filter(User.role != 'admin', User.total_score > (score or 0))
+             .scalar())
+    return ahead + 1
+
+
+def rank_of(user):
+    """1-based leaderboard rank of ``user`` (tied scores share a rank), or None for admins."""
+    if user.role == 'admin':
+        return None
+    return _rank_for_score(user.total_score)
+
+
+def page_ranks(scores, offset):
+    """Ranks for a page of ``ranked_users()`` scores starting at ``offset``, matching ``rank_of()``."""
+    ranks = []
+    for i, score in enumerate(scores):
+        score = score or 0
+        if i and score == previous:
+            ranks.append(ranks[-1])
+        elif i == 0 and offset:
+            # The first row may tie with rows on the previous page
+            ranks.append(_rank_for_score(score))
+        else:
+            ranks.append(offset + i + 1)
+        previous = score
+    return ranks
+
+
+def take_snapshot(taken_at=None):
+    """Record every student's current rank in one INSERT ... SELECT."""
+    taken_at = taken_at or datetime.utcnow()
+    ranks = (select(func.rank().over(order_by=func.coalesce(User.total_score, 0).desc()).label('rank'),
+                    User.id,
+                    func.coalesce(User.total_score, 0),
+                    db.literal(taken_at))
+             .where(User.role != 'admin'))
+    result = db.session.execute(
+        db.insert(LeaderboardSnapshot).from_select(['rank', 'user_id', 'total_score', 'taken_at'], ranks))
+    db.session.commit()
+    return result.rowcount
+
+
+def rank_history(user_id, limit=30):
+    """Most recent snapshots for a user, oldest first."""
+    snapshots = (LeaderboardSnapshot.query
+                 .filter_by(user_id=user_id)
+                 .order_by(LeaderboardSnapshot.taken_at.desc())
+                 .limit(limit)
+                 .all())
+    return list(reversed(snapshots))
@@ -0,0 +1,270 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+_TAG_RE = re.compile(r'</?(?:style|body)', re.IGNORECASE)
+_FALLBACK_RES = (
+    re.compile(r'</?html[^>]*>', re.IGNORECASE),
+    re.compile(r'</?head[^>]*>', re.IGNORECASE),
+    re.compile(r'</?title[^>]*>.*?</title>', re.IGNORECASE | re.DOTALL),
+)
+_LOOKAHEAD = 8
+_CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """A growing list of text slices copied from the input stream."""
+
+    __slots__ = ('parts', 'start')
+
+    def __init__(self, start=None):
+        self.parts = []
+        self.start = start
+
+
+class LessonSanitizer:
+    """Single-pass, incremental extractor for uploaded lesson HTML.
+
+    Produces the same output as the original regex chain: every ``<style>``
+    block (re-wrapped without attributes) followed by the content of the
+    first ``<body>`` element, or, when there is no complete body, the whole
+    document with ``html``/``head`` tags and ``title`` elements removed.
+
+    Text between style and body tags is never inspected character by
+    character in Python; each matcher only records slice boundaries, so
+    large inline assets such as base64 images are copied, not re-scanned.
+    The rare document without a complete body goes through the original
+    removal passes at ``close()``: they run one after another, so a tag
+    left unclosed by one pass can be matched differently by the next, and
+    only running them in order gives the same output.
+    """
+
+    def __init__(self):
+        self._buf = ''
+        self._base = 0
+        self._pos = 0
+        self._eof = False
+
+        self._styles = []
+        self._style = _Sink()
+        self._style_cursor = 0
+
+        self._body = _Sink()
+        self._body_state = 'seek'
+        self._body_cursor = 0
+
+        # The raw document, kept until a complete body makes it unnecessary
+        self._fallback = _Sink(start=0)
+
+    def feed(self, data):
+        self._buf += data
+        self._scan()
+        self._compact()
+
+    def close(self):
+        self._eof = True
+        self._scan()
+        end = self._base + len(self._buf)
+        styles = ''.join(f'<style>{style}</style>' for style in self._styles)
+        if self._body_state == 'done':
+            return styles + ''.join(self._body.parts)
+        self._take(self._fallback, end)
+        content = ''.join(self._fallback.parts)
+        for pattern in _FALLBACK_RES:
+            content = pattern.sub('', content)
+        return styles + content
+
+    def _take(self, sink, end):
+        if end > sink.start:
+            sink.parts.append(self._buf[sink.start - self._base:end - self._base])
+            sink.start = end
+
+    def _stop(self, sink, end):
+        self._take(sink, end)
+        sink.start = None
+
+    def _scan(self):
+        buf = self._buf
+        limit = len(buf) if self._eof else len(buf) - _LOOKAHEAD
+        while True:
+            m = _TAG_RE.search(buf, self._pos - self._base)
+            if m is None or m.start() >= limit:
+                self._pos = max(self._pos, self._base + limit)
+                return
+            i = m.start()
+            gt = buf.find('>', i)
+            if gt == -1 and not self._eof:
+                # The tag may still be closed by data we have not seen yet
+                self._pos = self._base + i
+                return
+            self._event(self._base + i, buf[i:i + _LOOKAHEAD].lower(),
+                        self._base + gt if gt != -1 else -1)
+            self._pos = self._base + i + 1
+
+    def _event(self, i, tag, gt):
+        # <style[^>]*>(.*?)</style>, for every match
+        if i >= self._style_cursor:
+            if self._style.start is None:
+                if tag.startswith('<style') and gt != -1:
+                    self._style.start = self._style_cursor = gt + 1
+            elif tag.startswith('</style>'):
+                self._stop(self._style, i)
+                self._styles.append(''.join(self._style.parts))
+                self._style.parts = []
+                self._style_cursor = i + 8
+
+        # <body[^>]*>(.*?)</body>, first match only
+        if self._body_state == 'seek':
+            if tag.startswith('<body') and gt != -1:
+                self._body.start = self._body_cursor = gt + 1
+                self._body_state = 'open'
+        elif self._body_state == 'open' and i >= self._body_cursor and tag.startswith('</body>'):
+            self._stop(self._body, i)
+            self._body_state = 'done'
+            # The fallback output can no longer be used
+            self._fallback = _Sink()
+
+    def _compact(self):
+        keep = self._pos
+        for sink in (self._style, self._body, self._fallback):
+            if sink.start is not None and sink.start < keep:
+                self._take(sink, keep)
+        self._buf = self._buf[keep - self._base:]
+        self._base = keep
+
+
+def sanitize_html_stream(stream, chunk_size=_CHUNK_SIZE):
+    """Sanitize lesson HTML read incrementally from a text stream."""
+    sanitizer = LessonSanitizer()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        sanitizer.feed(chunk)
+    return sanitizer.close()
+
+
+def sanitize_html_content(html_content):
+    """Extract styles and body content from HTML while preserving functionality."""
+    sanitizer = LessonSanitizer()
+    sanitizer.feed(html_content)
+    return sanitizer.close()
+
+
+class LessonCache:
+    """Bounded LRU cache of sanitized lesson HTML.
+
+    Entries are keyed on the file path plus its mtime and size, so a
+    re-uploaded lesson is picked up on the next request. When ``cache_dir``
+    is set, rendered output is also written there so that every gunicorn
+    worker can reuse it.
+    """
+
+    def __init__(self, max_entries=128, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def configure(self, max_entries=None, cache_dir=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self.cache_dir = cache_dir
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, path):
+        """Return sanitized HTML for ``path``, rendering it on a miss.
+
+        Raises FileNotFoundError if the lesson file does not exist.
+        """
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+
+        html = self._read_disk(key)
+        if html is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = sanitize_html_stream(f)
+            self._write_disk(key, html)
+            with self._lock:
+                self.misses += 1
+
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            # Drop entries for older versions of this file as well as the LRU tail
+            for stale in [k for k in self._entries if k[0] == path and k != key]:
+                del self._entries[stale]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.html')
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, html):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            target = self._disk_path(key)
+            tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(tmp, target)
+        except OSError:
+            pass
+
+
+lesson_cache = LessonCache()
+
+
+def init_app(app):
+    lesson_cache.configure(max_entries=app.config.get('LESSON_CACHE_SIZE', 128),
+                           cache_dir=app.config.get('LESSON_CACHE_DIR'))
+
+
+def render_lesson_html(app, html_file):
+    """Return the sanitized HTML for a lesson's uploaded file."""
+    return lesson_cache.get(os.path.join(app.static_folder, html_file))
@@ -0,0 +1,233 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, abort, g, request, template_rendered, before_render_template
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """In-process metrics with Prometheus text exposition.
+
+    Updates go to a per-thread shard (a plain dict reached through
+    ``threading.local``), so recording a sample takes no lock; a scrape
+    sums the shards of every thread. Each gunicorn worker has its own
+    registry, so a scrape reports the worker that served it.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """Register ``func()`` returning ``[(name, type, help, [(labels, value), ...]), ...]`` at scrape time."""
+        if func not in self._collectors:
+            self._collectors.append(func)
+        return func
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _merged(self):
+        """Sum every thread's shard; shards of finished threads are folded into one."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)
+            self._shards = live
+            totals = {key: list(values) for key, values in self._retired.items()}
+            shards = [shard for _, shard in live]
+        for shard in shards:
+            _merge(totals, shard)
+        return totals
+
+    def exposition(self):
+        totals = self._merged()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render({labels: values for (owner, labels), values in totals.items() if owner is metric}))
+        for func in self._collectors:
+            for name, kind, documentation, samples in func():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(into, shard):
+    for key, values in list(shard.items()):
+        current = into.get(key)
+        if current is None:
+            into[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                current[i] += value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, registry, name, documentation, labelnames):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount=1, labels=()):
+        """Add ``amount``; ``labels`` are the values for ``labelnames`` in order."""
+        shard = self._registry._shard()
+        key = (self, labels)
+        values = shard.get(key)
+        if values is None:
+            shard[key] = [amount]
+        else:
+            values[0] += amount
+
+    def render(self, samples):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labels, (value,) in sorted(samples.items()):
+            lines.append(f'{self.name}{_format_labels(dict(zip(self.labelnames, labels)))} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self._registry._shard()
+        key = (self, labels)
+        values = shard.get(key)
+        if values is None:
+            # One count per bucket, one for +Inf, then the running sum
+            values = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self, samples):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, values in sorted(samples.items()):
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(dict(base, le=_format_value(float(bound))))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(base)} {_format_value(values[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(base)} {cumulative}')
+        return lines
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request.', ('endpoint', 'method', 'status'))
+request_db_duration = registry.histogram(
+    'http_request_db_duration_seconds', 'Time spent in SQL per request.', ('endpoint',))
+template_duration = registry.histogram(
+    'template_render_duration_seconds', 'Time spent rendering a template.', ('template',))
+uploads_total = registry.counter('uploads_total', 'Uploads by kind and outcome.', ('kind', 'result'))
+upload_bytes_total = registry.counter('upload_bytes_total', 'Bytes of accepted uploads.', ('kind',))
+emails_total = registry.counter('emails_total', 'Outbox emails by outcome.', ('result',))
+
+
+def _cache_samples():
+    from app.lessons import lesson_cache
+    from app.user_cache import user_cache
+    from app.dbhealth import pool_stats
+    lessons = lesson_cache.stats()
+    users = user_cache.stats()
+    pool = pool_stats.stats()
+    return [
+        ('cache_hits_total', 'counter', 'Cache hits by cache.',
+         [({'cache': 'lessons'}, lessons['hits'] + lessons['disk_hits']), ({'cache': 'users'}, users['hits'])]),
+        ('cache_misses_total', 'counter', 'Cache misses by cache.',
+         [({'cache': 'lessons'}, lessons['misses']), ({'cache': 'users'}, users['misses'])]),
+        ('db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.', [({}, pool['checkouts'])]),
+        ('db_pool_timeouts_total', 'counter', 'Checkouts that timed out waiting for a connection.', [({}, pool['timeouts'])]),
+    ]
+
+
+def init_app(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    registry.collector(_cache_samples)
+    token = app.config.get('METRICS_TOKEN')
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get('metrics_started')
+        if started is None or request.endpoint in (None, 'static', 'metrics'):
+            return response
+        endpoint = request.endpoint
+        request_duration.observe(time.perf_counter() - started, (endpoint, request.method, str(response.status_code)))
+        queries = g.get('sql_queries')
+        if queries is not None:
+            request_db_duration.observe(sum(seconds for _, seconds in queries), (endpoint,))
+        return response
+
+    def start_template(sender, template, context, **extra):
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+    def finish_template(sender, template, context, **extra):
+        stack = g.get('template_started')
+        if stack:
+            template_duration.observe(time.perf_counter() - stack.pop(), (template.name or '<string>',))
+
+    before_render_template.connect(start_template, app, weak=False)
+    template_rendered.connect(finish_template, app, weak=False)
+
+    def metrics():
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+        return Response(registry.exposition(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,12 +1,27 @@
 from app import db, login
+from flask import current_app, has_app_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import event
 import secrets
 
+def password_hash_method():
+    """The configured PASSWORD_HASH_METHOD, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'."""
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    return 'scrypt'
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    # Werkzeug expands defaults (e.g. 'scrypt' -> 'scrypt:32768:8:1'), so hash once to learn the stored form
+    return generate_password_hash('', method=method).split('$', 1)[0] + '$'
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    from app.user_cache import user_cache
+    return user_cache.load(int(id))
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,14 +33,24 @@ class User(UserMixin, db.Model):
     total_score = db.Column(db.Integer, default=0)
     reset_token = db.Column(db.String(100), nullable=True)
     reset_token_expires = db.Column(db.DateTime, nullable=True)
+    # Bumped on every change to the row; the user cache compares it when revalidating an entry
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     submissions = db.relationship('Submission', backref='author', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_user_role_total_score', 'role', 'total_score'),
+    )
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=password_hash_method())
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self):
+        """True if the stored hash was made with a different method or cost than configured."""
+        return not (self.password_hash or '').startswith(_hash_prefix(password_hash_method()))
+
     def generate_reset_token(self, expires_in=3600):
         token = secrets.token_urlsafe(32)
         self.reset_token = token
@@ -45,12 +70,26 @@ class User(UserMixin, db.Model):
         self.reset_token_expires = None
         db.session.commit()
 
+@event.listens_for(User, 'before_update')
+def _bump_user_version(mapper, connection, target):
+    # Incremented in SQL, not compared, so concurrent writers never conflict
+    target.version = User.version + 1
+
 class Assignment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(140))
     description = db.Column(db.Text)
     max_score = db.Column(db.Integer)
     submissions = db.relationship('Submission', backref='assignment', lazy='dynamic')
+    test_cases = db.relationship('TestCase', backref='assignment', lazy='dynamic')
+
+class TestCase(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), index=True, nullable=False)
+    name = db.Column(db.String(140), nullable=False)
+    stdin = db.Column(db.Text)
+    expected_output = db.Column(db.Text)
+    points = db.Column(db.Integer, nullable=False, default=1)
 
 class Submission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -61,6 +100,42 @@ class Submission(db.Model):
     feedback = db.Column(db.Text)
     submitted_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_submission_assignment_id_submitted_at', 'assignment_id', 'submitted_at', 'id'),
+        db.Index('ix_submission_user_id_submitted_at', 'user_id', 'submitted_at', 'id'),
+        db.Index('ix_submission_ungraded', 'submitted_at', 'id',
+                 postgresql_where=db.text('score IS NULL'), sqlite_where=db.text('score IS NULL')),
+    )
+
+class SubmissionFingerprint(db.Model):
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), index=True, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False)
+    signature = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SimilarityBucket(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+    band = db.Column(db.SmallInteger, nullable=False)
+    bucket = db.Column(db.BigInteger, nullable=False)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), index=True, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_similarity_bucket_assignment_id_band_bucket', 'assignment_id', 'band', 'bucket'),
+    )
+
+class SimilarityPair(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+    first_id = db.Column(db.Integer, db.ForeignKey('submission.id'), index=True, nullable=False)
+    second_id = db.Column(db.Integer, db.ForeignKey('submission.id'), index=True, nullable=False)
+    similarity = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_similarity_pair_assignment_id_similarity', 'assignment_id', 'similarity'),
+    )
+
 class Day(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(140))
@@ -85,4 +160,64 @@ class Note(db.Model):
     title = db.Column(db.String(140))
     content = db.Column(db.Text)
     lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'))
-    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+class LeaderboardSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    total_score = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_leaderboard_snapshot_user_id_taken_at', 'user_id', 'taken_at'),
+    )
+
+class StoredFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), index=True, nullable=False)
+    path = db.Column(db.String(255), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OutboxEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(120))
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_outbox_email_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+class Notification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    digested_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_notification_digested_at_user_id', 'digested_at', 'user_id'),
+    )
+
+class SearchDocument(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(140))
+    body = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_search_document_kind_ref_id', 'kind', 'ref_id', unique=True),
+    )
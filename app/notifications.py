@@ -0,0 +1,131 @@
+import threading
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import insert, select, update
+from app import db
+from app.models import Notification, User
+from app.outbox import enqueue, outbox_worker
+
+# kind -> heading in the digest, in display order
+SECTIONS = {
+    'assignment': 'New assignments',
+    'grade': 'Grades',
+    'feedback': 'Feedback',
+}
+
+
+class DigestStats:
+    """Per-process counters for digest flushes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.emails = 0
+        self.events = 0
+
+    def record(self, emails, events):
+        with self._lock:
+            self.flushes += 1
+            self.emails += emails
+            self.events += events
+
+    def stats(self):
+        with self._lock:
+            return {
+                'flushes': self.flushes,
+                'emails': self.emails,
+                'events': self.events,
+                'events_per_email': round(self.events / self.emails, 2) if self.emails else None,
+            }
+
+
+digest_stats = DigestStats()
+
+
+def notify(user_id, kind, message):
+    """Record an event for ``user_id`` in the current session; it goes out in the next digest."""
+    db.session.add(Notification(user_id=user_id, kind=kind, message=message))
+
+
+def notify_many(events):
+    """Bulk-insert ``{'user_id', 'kind', 'message'}`` dicts in the current session."""
+    if events:
+        db.session.execute(insert(Notification), events)
+
+
+def notify_students(kind, message):
+    """Record the same event for every student with one INSERT ... SELECT."""
+    students = select(User.id, db.literal(kind), db.literal(message), db.literal(datetime.utcnow())).where(User.role != 'admin')
+    db.session.execute(
+        insert(Notification).from_select(['user_id', 'kind', 'message', 'created_at'], students))
+
+
+def review_event(title, old_score, score, max_score, old_feedback, feedback):
+    """Return ``(kind, message)`` describing a review, or None if nothing changed."""
+    if score != old_score:
+        message = f'"{title}" was graded {score}/{max_score}.'
+        if feedback:
+            message += f' Feedback: {feedback}'
+        return 'grade', message
+    if feedback and feedback != old_feedback:
+        return 'feedback', f'New feedback on "{title}": {feedback}'
+    return None
+
+
+def _digest_body(username, events):
+    lines = [f'Hi {username},', '', 'Here is what happened since your last update:']
+    for kind, heading in SECTIONS.items():
+        messages = [message for event_kind, message in events if event_kind == kind]
+        if messages:
+            lines += ['', heading]
+            lines += [f'- {message}' for message in messages]
+    lines += ['', 'You are receiving this because you are enrolled on the Python Learning Platform.', '']
+    return '\n'.join(lines)
+
+
+def flush_digests(app=None):
+    """Turn every pending notification into one outbox email per user.
+
+    Pending rows are claimed with a single UPDATE ... RETURNING, so flushes
+    running in several processes never digest the same event twice. The
+    emails are queued in the same transaction and then delivered by the
+    outbox worker in batches over one SMTP connection.
+    Returns ``(emails, events)``.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Notification)
+        .where(Notification.digested_at.is_(None))
+        .values(digested_at=now)
+        .returning(Notification.user_id, Notification.kind, Notification.message,
+                   Notification.created_at, Notification.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not claimed:
+        db.session.commit()
+        return 0, 0
+    claimed.sort(key=lambda row: (row.user_id, row.created_at, row.id))
+    users = {user.id: user for user in
+             db.session.query(User.id, User.username, User.email)
+             .filter(User.id.in_({row.user_id for row in claimed}))}
+    emails = 0
+    for user_id, rows in groupby(claimed, key=lambda row: row.user_id):
+        user = users.get(user_id)
+        if user is None or not user.email:
+            continue
+        events = [(row.kind, row.message) for row in rows]
+        enqueue(f'Your update: {len(events)} new item(s)', [user.email], _digest_body(user.username, events))
+        emails += 1
+    db.session.commit()
+    digest_stats.record(emails, len(claimed))
+    if emails:
+        outbox_worker.wake()
+    if app is not None:
+        app.logger.info(f"Digest flush queued {emails} email(s) for {len(claimed)} event(s)")
+    return emails, len(claimed)
+
+
+def init_app(app):
+    interval = app.config.get('NOTIFICATION_DIGEST_INTERVAL')
+    if interval and app.config.get('OUTBOX_WORKER'):
+        outbox_worker.every(interval, flush_digests)
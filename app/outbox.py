@@ -0,0 +1,253 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from flask_mail import Message
+from sqlalchemy import and_, select, update
+from app import db, mail
+from app.models import OutboxEmail
+from app.metrics import emails_total
+
+# A claimed email that is still 'sending' after this long was lost with its worker
+SENDING_LEASE = timedelta(minutes=5)
+
+
+def enqueue(subject, recipients, body, html=None, sender=None):
+    """Add an email to the outbox in the current session.
+
+    Nothing is sent until the caller commits; the worker then picks it up.
+    """
+    email = OutboxEmail(subject=subject, sender=sender, recipients=','.join(recipients),
+                        body=body, html=html, next_attempt_at=datetime.utcnow())
+    db.session.add(email)
+    emails_total.inc(labels=('queued',))
+    return email
+
+
+def send_email(subject, recipients, body, html=None, sender=None):
+    """Queue an email, commit, and wake the worker. Returns immediately."""
+    email = enqueue(subject, recipients, body, html=html, sender=sender)
+    db.session.commit()
+    outbox_worker.wake()
+    return email
+
+
+def _due(now):
+    return and_(OutboxEmail.status.in_(('pending', 'sending')), OutboxEmail.next_attempt_at <= now)
+
+
+def claim_batch(limit):
+    """Atomically mark up to ``limit`` due emails as 'sending' and return them.
+
+    The claim is a single UPDATE ... RETURNING, so concurrent workers (threads
+    or processes) never receive the same email.
+    """
+    now = datetime.utcnow()
+    due_ids = (select(OutboxEmail.id).where(_due(now))
+               .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id).limit(limit))
+    claimed = db.session.execute(
+        update(OutboxEmail)
+        .where(OutboxEmail.id.in_(due_ids), _due(now))
+        .values(status='sending', next_attempt_at=now + SENDING_LEASE)
+        .returning(OutboxEmail.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutboxEmail.query.filter(OutboxEmail.id.in_(claimed)).order_by(OutboxEmail.id).all()
+
+
+class DeliveryStats:
+    """Per-process counters for outbox delivery."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.sent = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.last_rate = None
+
+    def record(self, sent, failed, seconds):
+        with self._lock:
+            self.batches += 1
+            self.sent += sent
+            self.failed += failed
+            self.seconds += seconds
+            if seconds:
+                self.last_rate = sent / seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'sent': self.sent,
+                'failed': self.failed,
+                'seconds': round(self.seconds, 3),
+                'rate_per_second': round(self.sent / self.seconds, 1) if self.seconds else None,
+                'last_batch_rate_per_second': round(self.last_rate, 1) if self.last_rate else None,
+            }
+
+
+delivery_stats = DeliveryStats()
+
+
+def retry_delay(attempts, base, maximum):
+    """Exponential backoff with jitter for the ``attempts``-th failure."""
+    delay = min(base * 2 ** (attempts - 1), maximum)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _message(email, default_sender):
+    return Message(email.subject,
+                   sender=email.sender or default_sender,
+                   recipients=email.recipients.split(','),
+                   body=email.body,
+                   html=email.html)
+
+
+def deliver(emails, config):
+    """Send ``emails`` over one SMTP connection; returns (sent, failed)."""
+    sent = failed = 0
+    started = time.perf_counter()
+    now = datetime.utcnow()
+
+    def fail(email, error):
+        email.attempts += 1
+        email.last_error = str(error)[:1000]
+        if email.attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+            email.status = 'failed'
+        else:
+            email.status = 'pending'
+            email.next_attempt_at = now + timedelta(
+                seconds=retry_delay(email.attempts, config['OUTBOX_RETRY_BASE'], config['OUTBOX_RETRY_MAX']))
+
+    try:
+        with mail.connect() as connection:
+            for email in emails:
+                try:
+                    connection.send(_message(email, config['MAIL_DEFAULT_SENDER']))
+                except Exception as e:
+                    fail(email, e)
+                    failed += 1
+                else:
+                    email.status = 'sent'
+                    email.sent_at = datetime.utcnow()
+                    email.last_error = None
+                    sent += 1
+    except Exception as e:
+        # Connecting (or closing) failed; anything not yet marked sent is retried
+        for email in emails:
+            if email.status == 'sending':
+                fail(email, e)
+                failed += 1
+    delivery_stats.record(sent, failed, time.perf_counter() - started)
+    emails_total.inc(sent, labels=('sent',))
+    emails_total.inc(failed, labels=('failed',))
+    db.session.commit()
+    return sent, failed
+
+
+def process_outbox(config, batch_size=None):
+    """Claim and deliver one batch of due emails; returns (sent, failed)."""
+    emails = claim_batch(batch_size or config['OUTBOX_BATCH_SIZE'])
+    if not emails:
+        return 0, 0
+    return deliver(emails, config)
+
+
+def drain(config, batch_size=None):
+    """Deliver everything that is due now; returns (sent, failed, seconds)."""
+    started = time.perf_counter()
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = process_outbox(config, batch_size)
+        total_sent += sent
+        total_failed += failed
+        if not sent and not failed:
+            break
+    return total_sent, total_failed, time.perf_counter() - started
+
+
+class OutboxWorker:
+    """Background thread that drains the outbox in each app process.
+
+    It sleeps for ``OUTBOX_POLL_INTERVAL`` between polls and is woken early
+    by ``wake()`` when a request queues a new email. Tasks added with
+    ``every()`` run on the same thread, before the outbox is drained.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._tasks = []
+
+    def every(self, interval, func):
+        """Call ``func(app)`` roughly every ``interval`` seconds."""
+        self._tasks = [task for task in self._tasks if task[1] is not func]
+        self._tasks.append([interval, func, time.monotonic() + interval])
+
+    def start(self, app):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            # A forked worker inherits _pid but not the thread, so check the pid
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, args=(app,), name='outbox', daemon=True)
+            thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            self._wake.clear()
+            sent = failed = 0
+            with app.app_context():
+                self._run_tasks(app)
+                try:
+                    sent, failed = process_outbox(app.config)
+                    if sent or failed:
+                        app.logger.info(f"Outbox delivered {sent} email(s), {failed} failed")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning(f"Outbox delivery failed: {str(e)}")
+                finally:
+                    db.session.remove()
+            if sent:
+                continue
+            timeout = app.config['OUTBOX_POLL_INTERVAL']
+            if self._tasks:
+                timeout = max(0, min([timeout] + [task[2] - time.monotonic() for task in self._tasks]))
+            self._wake.wait(timeout)
+
+    def _run_tasks(self, app):
+        now = time.monotonic()
+        for task in self._tasks:
+            interval, func, due = task
+            if due > now:
+                continue
+            task[2] = now + interval
+            try:
+                func(app)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning(f"Outbox task {func.__name__} failed: {str(e)}")
+
+
+outbox_worker = OutboxWorker()
+
+
+def init_app(app):
+    if not app.config.get('OUTBOX_WORKER'):
+        return
+
+    @app.before_request
+    def start_outbox_worker():
+        outbox_worker.start(app)
+
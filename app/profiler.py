@@ -0,0 +1,117 @@
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from app import db
+
+MAX_LOGGED_STATEMENT = 300
+
+
+class EndpointStats:
+    """Per-endpoint request, query and timing totals for this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.since = time.time()
+
+    def record(self, endpoint, seconds, queries, db_seconds):
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = self._endpoints[endpoint] = {
+                    'requests': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                    'queries': 0, 'max_queries': 0, 'db_seconds': 0.0, 'slow': 0,
+                }
+            entry['requests'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['queries'] += queries
+            entry['max_queries'] = max(entry['max_queries'], queries)
+            entry['db_seconds'] += db_seconds
+
+    def record_slow(self, endpoint):
+        with self._lock:
+            if endpoint in self._endpoints:
+                self._endpoints[endpoint]['slow'] += 1
+
+    def summary(self):
+        """Rows sorted by total time, with per-request averages."""
+        with self._lock:
+            rows = [dict(entry, endpoint=endpoint) for endpoint, entry in self._endpoints.items()]
+        for row in rows:
+            row['avg_ms'] = row['seconds'] / row['requests'] * 1000
+            row['avg_queries'] = row['queries'] / row['requests']
+            row['avg_db_ms'] = row['db_seconds'] / row['requests'] * 1000
+            row['max_ms'] = row['max_seconds'] * 1000
+        rows.sort(key=lambda row: row['seconds'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self.since = time.time()
+
+
+endpoint_stats = EndpointStats()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    started = started.pop()
+    if not has_request_context() or 'sql_queries' not in g:
+        return
+    g.sql_queries.append((statement, time.perf_counter() - started))
+
+
+def _format_query(statement, seconds):
+    statement = ' '.join(statement.split())
+    if len(statement) > MAX_LOGGED_STATEMENT:
+        statement = statement[:MAX_LOGGED_STATEMENT] + '...'
+    return f'  {seconds * 1000:8.2f} ms  {statement}'
+
+
+def init_app(app):
+    """Count and time SQL per request, log slow requests and add Server-Timing."""
+    if not app.config.get('PROFILER_ENABLED', True):
+        return
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    slow_request = app.config.get('SLOW_REQUEST_MS', 500) / 1000
+    slow_query = app.config.get('SLOW_QUERY_MS', 100) / 1000
+    query_limit = app.config.get('SLOW_REQUEST_QUERIES', 50)
+    server_timing = app.config.get('SERVER_TIMING', True)
+
+    @app.before_request
+    def start_profiling():
+        g.request_started = time.perf_counter()
+        g.sql_queries = []
+
+    @app.after_request
+    def finish_profiling(response):
+        if 'request_started' not in g or request.endpoint in (None, 'static'):
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        queries = g.sql_queries
+        db_seconds = sum(seconds for _, seconds in queries)
+        endpoint_stats.record(request.endpoint, elapsed, len(queries), db_seconds)
+        if server_timing:
+            response.headers.add('Server-Timing', f'db;dur={db_seconds * 1000:.2f};desc="{len(queries)} queries"')
+            response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+        slow_queries = [(statement, seconds) for statement, seconds in queries if seconds >= slow_query]
+        if elapsed >= slow_request or len(queries) >= query_limit or slow_queries:
+            endpoint_stats.record_slow(request.endpoint)
+            listed = queries if elapsed >= slow_request or len(queries) >= query_limit else slow_queries
+            app.logger.warning(
+                f"Slow request {request.method} {request.path} ({request.endpoint}): "
+                f"{elapsed * 1000:.1f} ms, {len(queries)} queries, {db_seconds * 1000:.1f} ms in SQL\n"
+                + '\n'.join(_format_query(statement, seconds) for statement, seconds in listed))
+        return response
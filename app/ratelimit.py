@@ -0,0 +1,198 @@
+import math
+import random
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # only needed for a redis:// RATELIMIT_STORAGE_URL
+    redis = None
+
+
+class MemoryBackend:
+    """Token buckets in process memory; each gunicorn worker limits on its own."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now=None):
+        """Spend one token from ``key``; returns seconds to wait, 0 if allowed."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, None))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            # The third field is how long this bucket takes to refill completely
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens if wait else tokens - 1, now, capacity / rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return wait
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        for key in [key for key, (_, updated, full_after) in self._buckets.items() if now - updated > full_after]:
+            del self._buckets[key]
+
+
+class SQLiteBackend:
+    """Token buckets in a SQLite file, shared by every worker on one host."""
+
+    # Rows idle this long have refilled under any sane limit and are dropped now and then
+    IDLE_SECONDS = 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0, now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            if random.random() < 0.001:
+                connection.execute('DELETE FROM bucket WHERE updated < ?', (now - self.IDLE_SECONDS,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def reset(self, key):
+        self._connect().execute('DELETE FROM bucket WHERE key = ?', (key,))
+
+
+class RedisBackend:
+    """Token buckets in Redis (or anything speaking its protocol), shared across hosts."""
+
+    SCRIPT = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens < 1 then wait = (1 - tokens) / rate else tokens = tokens - 1 end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('The redis package is required for a redis:// rate limit backend.')
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        return float(self._take(keys=[f'ratelimit:{key}'], args=[capacity, rate, now]))
+
+    def reset(self, key):
+        self._client.delete(f'ratelimit:{key}')
+
+
+def backend_from_url(url):
+    """``memory://``, ``sqlite:///path/to/file.db`` or ``redis://host:port/db``."""
+    if not url or url == 'memory://':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f'Unsupported RATELIMIT_STORAGE_URL: {url}')
+
+
+class LoginLimiter:
+    """Per-IP, per-(IP, username) and per-account token buckets for login attempts.
+
+    Checked before the user is loaded or any password is hashed, so a
+    burst of attempts costs one dictionary (or backend) lookup each. The
+    tight username bucket is keyed on the IP too, so guessing someone's
+    password from one address cannot lock them out everywhere else; the
+    account bucket has a larger burst and throttles guessing spread over
+    many addresses.
+    """
+
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self.enabled = True
+        self.ip_limit = (20, 10 / 60)
+        self.username_limit = (5, 5 / 60)
+        self.account_limit = (50, 10 / 60)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('LOGIN_RATE_LIMIT', True)
+        self.backend = backend_from_url(app.config.get('RATELIMIT_STORAGE_URL'))
+        self.ip_limit = (app.config.get('LOGIN_IP_BURST', 20), app.config.get('LOGIN_IP_PER_MINUTE', 10) / 60)
+        self.username_limit = (app.config.get('LOGIN_USERNAME_BURST', 5),
+                               app.config.get('LOGIN_USERNAME_PER_MINUTE', 5) / 60)
+        self.account_limit = (app.config.get('LOGIN_ACCOUNT_BURST', 50),
+                              app.config.get('LOGIN_ACCOUNT_PER_MINUTE', 10) / 60)
+
+    def check(self, ip, username):
+        """Spend one attempt for ``ip`` and ``username``; returns seconds to wait, 0 if allowed."""
+        if not self.enabled:
+            return 0
+        wait = self.backend.take(f'login:ip:{ip}', *self.ip_limit)
+        if not wait and username:
+            wait = self.backend.take(self._user_key(ip, username), *self.username_limit)
+        if not wait and username:
+            wait = self.backend.take(f'login:user:{username.lower()}', *self.account_limit)
+        with self._lock:
+            if wait:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        return math.ceil(wait)
+
+    def succeeded(self, ip, username):
+        """Forget failed attempts against ``username`` from ``ip`` after a successful login.
+
+        The account bucket is left alone: a login from one address must not
+        refill it for attempts coming from everywhere else.
+        """
+        if self.enabled and username:
+            self.backend.reset(self._user_key(ip, username))
+
+    @staticmethod
+    def _user_key(ip, username):
+        return f'login:ip-user:{ip}:{username.lower()}'
+
+    def stats(self):
+        with self._lock:
+            return {'backend': type(self.backend).__name__, 'allowed': self.allowed, 'rejected': self.rejected}
+
+
+login_limiter = LoginLimiter()
+
+
+def init_app(app):
+    login_limiter.init_app(app)
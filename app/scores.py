@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+from collections import defaultdict
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Assignment, Submission, User
+from app.notifications import notify_many, review_event
+from app.user_cache import user_cache
+
+
+def score_history(user_id, days=30):
+    """Return a user's recent submissions and their chart series.
+
+    Submissions are loaded with their assignment in a single joined query,
+    so neither the chart nor the submissions table triggers lazy loads.
+    Returns ``(submissions, chart_dates, chart_scores)``.
+    """
+    since = datetime.now() - timedelta(days=days)
+    submissions = (Submission.query
+                   .options(joinedload(Submission.assignment))
+                   .filter(Submission.user_id == user_id, Submission.submitted_at >= since)
+                   .order_by(Submission.submitted_at)
+                   .all())
+    chart_dates = []
+    chart_scores = []
+    for sub in submissions:
+        if sub.score is not None:
+            chart_dates.append(sub.submitted_at.strftime('%Y-%m-%d'))
+            percentage = (sub.score / sub.assignment.max_score) * 100
+            chart_scores.append(round(percentage, 2))
+    return submissions, chart_dates, chart_scores
+
+
+def score_error(score, max_score):
+    """Return why ``score`` is not acceptable for an assignment, or None."""
+    if max_score is not None and score > max_score:
+        return f'Score cannot exceed the maximum score of {max_score}.'
+    return None
+
+
+def apply_reviews(reviews):
+    """Grade many submissions in one transaction.
+
+    ``reviews`` is a list of dicts with ``line``, ``submission_id``,
+    ``score`` and ``feedback`` (None keeps the existing feedback). Every
+    row is validated against its assignment's max_score from a single
+    query; valid rows are written with one bulk UPDATE per table.
+    Returns ``(applied, errors)`` where errors are ``(line, message)``.
+    """
+    errors = []
+    if not reviews:
+        return 0, errors
+    ids = {review['submission_id'] for review in reviews}
+    current = {row.id: row for row in
+               db.session.query(Submission.id, Submission.user_id, Submission.score,
+                                Submission.feedback, Assignment.max_score, Assignment.title)
+               .join(Assignment, Submission.assignment_id == Assignment.id)
+               .filter(Submission.id.in_(ids))
+               .with_for_update(of=Submission)}
+
+    updates = {}
+    deltas = defaultdict(int)
+    events = []
+    for review in reviews:
+        row = current.get(review['submission_id'])
+        if row is None:
+            errors.append((review['line'], f"Submission {review['submission_id']} does not exist."))
+            continue
+        if row.id in updates:
+            errors.append((review['line'], f'Submission {row.id} appears more than once.'))
+            continue
+        error = score_error(review['score'], row.max_score)
+        if error:
+            errors.append((review['line'], error))
+            continue
+        feedback = review['feedback'] if review['feedback'] is not None else row.feedback
+        updates[row.id] = {'id': row.id, 'score': review['score'], 'feedback': feedback}
+        deltas[row.user_id] += review['score'] - (row.score or 0)
+        event = review_event(row.title, row.score, review['score'], row.max_score, row.feedback, feedback)
+        if event:
+            events.append({'user_id': row.user_id, 'kind': event[0], 'message': event[1]})
+
+    if updates:
+        db.session.execute(update(Submission), list(updates.values()))
+        user_table = User.__table__
+        changes = [{'user_id': user_id, 'delta': delta} for user_id, delta in deltas.items() if delta]
+        if changes:
+            db.session.execute(
+                update(user_table)
+                .where(user_table.c.id == bindparam('user_id'))
+                .values(total_score=func.coalesce(user_table.c.total_score, 0) + bindparam('delta'),
+                        version=user_table.c.version + 1),
+                changes)
+        notify_many(events)
+    db.session.commit()
+    user_cache.invalidate(*deltas)
+    return len(updates), errors
+
+
+def add_to_total_score(user_id, difference):
+    """Adjust a user's total_score with a single SQL-side increment."""
+    if not difference:
+        return
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(total_score=func.coalesce(User.total_score, 0) + difference, version=User.version + 1)
+        .execution_options(synchronize_session=False))
+
+
+def recompute_total_scores():
+    """Rewrite every drifted total_score from the sum of its submissions.
+
+    Runs as one set-based UPDATE and returns the number of users changed.
+    """
+    actual = (select(func.coalesce(func.sum(Submission.score), 0))
+              .where(Submission.user_id == User.id)
+              .scalar_subquery())
+    result = db.session.execute(
+        update(User)
+        .where(User.total_score.is_distinct_from(actual))
+        .values(total_score=actual, version=User.version + 1)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    user_cache.clear()
+    return result.rowcount
+
+
+def find_score_drift():
+    """Users whose total_score differs from the sum of their submission scores.
+
+    Returns ``(user_id, username, total_score, actual)`` rows.
+    """
+    totals = (db.session.query(Submission.user_id, func.sum(Submission.score).label('actual'))
+              .group_by(Submission.user_id)
+              .subquery())
+    actual = func.coalesce(totals.c.actual, 0)
+    return (db.session.query(User.id, User.username, User.total_score, actual.label('actual'))
+            .outerjoin(totals, totals.c.user_id == User.id)
+            .filter(func.coalesce(User.total_score, 0) != actual)
+            .order_by(User.id)
+            .all())
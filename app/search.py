@@ -0,0 +1,234 @@
+import html
+import os
+import re
+from collections import namedtuple
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+from sqlalchemy import insert, text
+from app import db
+from app.models import SearchDocument, Note, Lesson, Program, Assignment
+
+KINDS = ('note', 'lesson', 'program', 'assignment')
+MAX_TERMS = 8
+
+# Hits are wrapped in control characters by the database, then escaped and turned into <mark>
+_HIT_START, _HIT_END = '\x02', '\x03'
+
+_SKIP_RE = re.compile(r'<(script|style|template|noscript|title)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]*>')
+_CONTROL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+_SPACE_RE = re.compile(r'\s+')
+_TERM_RE = re.compile(r'\w+')
+
+# External-content FTS5 table kept in step with search_document by triggers
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, body, content='search_document', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+    "INSERT INTO search_index (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+    "INSERT INTO search_index (search_index, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+    "INSERT INTO search_index (search_index, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_index (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+)
+
+# Queries must repeat this expression verbatim for Postgres to use the GIN index
+PG_VECTOR = ("setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+             "setweight(to_tsvector('english', coalesce(body, '')), 'B')")
+POSTGRES_DDL = (
+    f"CREATE INDEX IF NOT EXISTS ix_search_document_vector ON search_document USING gin (({PG_VECTOR}))",
+)
+
+# Rank and page first so snippets are only built for the rows that are shown;
+# CROSS JOIN keeps SQLite looking those rows up by rowid instead of rescanning the match
+_SQLITE_SEARCH = """
+WITH hits AS (
+    SELECT search_index.rowid AS id, bm25(search_index, 10.0, 1.0) AS score
+    FROM search_index {kind_join}
+    WHERE search_index MATCH :match {kind_filter}
+    ORDER BY score
+    LIMIT :limit OFFSET :offset
+)
+SELECT d.kind, d.ref_id,
+       highlight(search_index, 0, char(2), char(3)) AS title,
+       snippet(search_index, 1, char(2), char(3), '…', 24) AS snippet
+FROM hits CROSS JOIN search_index ON search_index.rowid = hits.id
+JOIN search_document AS d ON d.id = hits.id
+WHERE search_index MATCH :match
+ORDER BY hits.score
+"""
+
+# Same shape for Postgres: ts_headline only runs on the page of hits
+_POSTGRES_SEARCH = f"""
+WITH q AS (SELECT to_tsquery('english', :match) AS query),
+hits AS (
+    SELECT search_document.id, ts_rank_cd({PG_VECTOR}, q.query) AS rank
+    FROM search_document, q
+    WHERE {PG_VECTOR} @@ q.query {{kind_filter}}
+    ORDER BY rank DESC, search_document.id
+    LIMIT :limit OFFSET :offset
+)
+SELECT d.kind, d.ref_id,
+       ts_headline('english', coalesce(d.title, ''), q.query, :title_options) AS title,
+       ts_headline('english', coalesce(d.body, ''), q.query, :body_options) AS snippet
+FROM hits JOIN search_document AS d ON d.id = hits.id, q
+ORDER BY hits.rank DESC, hits.id
+"""
+
+_ENDPOINTS = {
+    'note': ('student.view_note', 'id'),
+    'lesson': ('student.view_lesson', 'lesson_id'),
+    'program': ('student.view_program', 'program_id'),
+    'assignment': ('student.view_assignment', 'id'),
+}
+
+
+class SearchResult(namedtuple('SearchResult', 'kind ref_id title snippet')):
+    @property
+    def url(self):
+        endpoint, arg = _ENDPOINTS[self.kind]
+        return url_for(endpoint, **{arg: self.ref_id})
+
+
+def normalize_text(value, limit=None):
+    """Collapse whitespace and drop control characters (they mark hits in results)."""
+    value = _SPACE_RE.sub(' ', _CONTROL_RE.sub('', value or '')).strip()
+    return value[:limit] if limit else value
+
+
+def extract_html_text(markup):
+    """Visible text of an HTML document, without scripts, styles or tags."""
+    markup = _COMMENT_RE.sub(' ', markup)
+    markup = _SKIP_RE.sub(' ', markup)
+    return html.unescape(_TAG_RE.sub(' ', markup))
+
+
+def _read_upload(relative_path):
+    path = os.path.join(current_app.static_folder, relative_path)
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except FileNotFoundError:
+        current_app.logger.warning(f"Cannot index missing upload {relative_path}")
+        return ''
+
+
+def lesson_text(lesson):
+    return extract_html_text(_read_upload(lesson.html_file)) if lesson.html_file else ''
+
+
+def program_text(program):
+    return _read_upload(program.python_file) if program.python_file else ''
+
+
+def _document(kind, ref_id, title, body):
+    limit = current_app.config.get('SEARCH_MAX_INDEXED_CHARS', 200000)
+    return {'kind': kind, 'ref_id': ref_id, 'title': normalize_text(title, 140), 'body': normalize_text(body, limit)}
+
+
+def _upsert(kind, obj, title, body):
+    if obj.id is None:
+        db.session.flush()
+    values = _document(kind, obj.id, title, body)
+    document = SearchDocument.query.filter_by(kind=kind, ref_id=obj.id).first()
+    if document is None:
+        db.session.add(SearchDocument(**values))
+    else:
+        document.title = values['title']
+        document.body = values['body']
+
+
+def index_note(note):
+    _upsert('note', note, note.title, note.content)
+
+
+def index_lesson(lesson):
+    """Index a lesson, reading the text out of its uploaded HTML file."""
+    _upsert('lesson', lesson, lesson.title, lesson_text(lesson))
+
+
+def index_program(program):
+    _upsert('program', program, program.title, program_text(program))
+
+
+def index_assignment(assignment):
+    _upsert('assignment', assignment, assignment.title, assignment.description)
+
+
+def remove(kind, ref_ids):
+    """Drop documents of ``kind`` whose ids are in ``ref_ids`` (a list or a SELECT)."""
+    return (SearchDocument.query.filter(SearchDocument.kind == kind, SearchDocument.ref_id.in_(ref_ids))
+            .delete(synchronize_session=False))
+
+
+def clear():
+    return SearchDocument.query.delete(synchronize_session=False)
+
+
+def create_index():
+    """Create the engine's full-text index if the migration has not (e.g. a fresh create_all)."""
+    dialect = db.engine.dialect.name
+    statements = SQLITE_DDL if dialect == 'sqlite' else POSTGRES_DDL if dialect == 'postgresql' else ()
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def reindex_all():
+    """Rebuild every document from the content tables; returns counts per kind."""
+    clear()
+    counts = {}
+    sources = (
+        ('note', Note.query, lambda note: (note.title, note.content)),
+        ('lesson', Lesson.query, lambda lesson: (lesson.title, lesson_text(lesson))),
+        ('program', Program.query, lambda program: (program.title, program_text(program))),
+        ('assignment', Assignment.query, lambda assignment: (assignment.title, assignment.description)),
+    )
+    for kind, query, fields in sources:
+        rows = [_document(kind, obj.id, *fields(obj)) for obj in query.yield_per(500)]
+        if rows:
+            db.session.execute(insert(SearchDocument), rows)
+        counts[kind] = len(rows)
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    db.session.commit()
+    return counts
+
+
+def _highlight(value):
+    return Markup(str(escape(value or '')).replace(_HIT_START, '<mark>').replace(_HIT_END, '</mark>'))
+
+
+def find(query, kind=None, page=1, per_page=20):
+    """Ranked, highlighted matches for ``query``; returns ``(results, has_next)``.
+
+    Every word must match and the last one also matches as a prefix.
+    Words are taken from the input one by one, so search syntax typed by
+    a user is never passed to the database.
+    """
+    terms = _TERM_RE.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return [], False
+    params = {'limit': per_page + 1, 'offset': (max(page, 1) - 1) * per_page}
+    kind_join = kind_filter = ''
+    if kind in KINDS:
+        kind_filter = 'AND search_document.kind = :kind'
+        params['kind'] = kind
+    if db.engine.dialect.name == 'postgresql':
+        params['match'] = ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+        params['title_options'] = f'HighlightAll=true, StartSel={_HIT_START}, StopSel={_HIT_END}'
+        params['body_options'] = (f'StartSel={_HIT_START}, StopSel={_HIT_END}, '
+                                  'MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=" … "')
+        sql = _POSTGRES_SEARCH.format(kind_filter=kind_filter)
+    else:
+        params['match'] = ' '.join(f'"{term}"' for term in terms) + '*'
+        if kind_filter:
+            kind_join = 'JOIN search_document ON search_document.id = search_index.rowid'
+        sql = _SQLITE_SEARCH.format(kind_join=kind_join, kind_filter=kind_filter)
+    rows = db.session.execute(text(sql), params).all()
+    results = [SearchResult(row.kind, row.ref_id, _highlight(row.title), _highlight(row.snippet))
+               for row in rows[:per_page]]
+    return results, len(rows) > per_page
@@ -0,0 +1,234 @@
+import builtins
+import hashlib
+import io
+import keyword
+import random
+import struct
+import time
+import tokenize
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert, or_, select, tuple_
+from sqlalchemy.orm import aliased
+from app import db
+from app.models import Submission, SubmissionFingerprint, SimilarityBucket, SimilarityPair, User
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE = 5
+WINDOW = 4
+
+# A fixed seed: signatures stored in the database must stay comparable across restarts
+_MASKS = [random.Random(0x5AB17 + i).getrandbits(64) for i in range(NUM_PERM)]
+_SIGNATURE = struct.Struct(f'<{NUM_PERM}Q')
+_BAND = struct.Struct(f'<{ROWS}Q')
+
+_KEEP_NAMES = frozenset(keyword.kwlist) | frozenset(keyword.softkwlist) | frozenset(dir(builtins))
+_SKIP_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+_TOKEN_NAMES = {tokenize.NUMBER: 'NUM', tokenize.STRING: 'STR', tokenize.NEWLINE: 'EOL',
+                tokenize.INDENT: 'IN', tokenize.DEDENT: 'DE'}
+
+SimilarPair = namedtuple('SimilarPair', 'similarity first_id first_user second_id second_user')
+
+
+def normalize_tokens(code):
+    """Python tokens with identifiers, numbers and strings replaced by placeholders.
+
+    Keywords, builtins and operators are kept, so renaming variables or
+    rewording comments and strings does not change the result. Code that
+    fails to tokenize contributes the tokens read before the error.
+    """
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code or '').readline):
+            if token.type in _SKIP_TOKENS:
+                continue
+            if token.type == tokenize.NAME:
+                tokens.append(token.string if token.string in _KEEP_NAMES else 'ID')
+            else:
+                tokens.append(_TOKEN_NAMES.get(token.type, token.string))
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return tokens
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def fingerprints(tokens):
+    """Winnowed k-gram hashes: the smallest hash of every window of WINDOW shingles."""
+    hashes = [_hash64(' '.join(tokens[i:i + SHINGLE]).encode()) for i in range(len(tokens) - SHINGLE + 1)]
+    if len(hashes) <= WINDOW:
+        return set(hashes)
+    return {min(hashes[i:i + WINDOW]) for i in range(len(hashes) - WINDOW + 1)}
+
+
+def signature(hashes):
+    """MinHash signature of a fingerprint set, NUM_PERM values.
+
+    Fingerprints are already uniform 64-bit hashes, so XOR with a random
+    mask reorders them well enough: every element of the union of two
+    sets is equally likely to be the minimum, which is what makes the
+    share of equal values estimate Jaccard similarity. It is several
+    times cheaper in pure Python than a multiply-mod permutation.
+    """
+    values = list(hashes)
+    return [min([value ^ mask for value in values]) for mask in _MASKS]
+
+
+def band_buckets(sig):
+    """LSH bucket per band; two signatures sharing any bucket become a candidate pair."""
+    return [(band, _hash64(_BAND.pack(*sig[band * ROWS:(band + 1) * ROWS])) - (1 << 63))
+            for band in range(BANDS)]
+
+
+def estimate(first, second):
+    """Estimated Jaccard similarity of the fingerprint sets behind two signatures."""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERM
+
+
+def _unpack(blob):
+    return _SIGNATURE.unpack(blob)
+
+
+def _threshold():
+    return current_app.config.get('SIMILARITY_MIN_PERCENT', 50) / 100
+
+
+def _forget(submission_ids):
+    SimilarityBucket.query.filter(SimilarityBucket.submission_id.in_(submission_ids)).delete(synchronize_session=False)
+    SimilarityPair.query.filter(or_(SimilarityPair.first_id.in_(submission_ids),
+                                    SimilarityPair.second_id.in_(submission_ids))).delete(synchronize_session=False)
+
+
+def _signature_for(code):
+    tokens = normalize_tokens(code)
+    if len(tokens) < current_app.config.get('SIMILARITY_MIN_TOKENS', 30):
+        return None, len(tokens)
+    hashes = fingerprints(tokens)
+    # Fewer than SHINGLE tokens give no fingerprints, whatever SIMILARITY_MIN_TOKENS says
+    if not hashes:
+        return None, len(tokens)
+    return signature(hashes), len(tokens)
+
+
+def index_submission(submission):
+    """Re-fingerprint one submission and refresh its pairs; returns pairs found.
+
+    Only submissions sharing an LSH bucket are compared, so the cost grows
+    with the number of near-duplicates rather than the class size. Runs
+    in the caller's transaction.
+    """
+    if submission.id is None:
+        db.session.flush()
+    _forget([submission.id])
+    sig, token_count = _signature_for(submission.code_text)
+    fingerprint = db.session.get(SubmissionFingerprint, submission.id)
+    if sig is None:
+        if fingerprint is not None:
+            db.session.delete(fingerprint)
+        return 0
+    if fingerprint is None:
+        fingerprint = SubmissionFingerprint(submission_id=submission.id, assignment_id=submission.assignment_id)
+        db.session.add(fingerprint)
+    fingerprint.token_count = token_count
+    fingerprint.signature = _SIGNATURE.pack(*sig)
+    fingerprint.updated_at = datetime.utcnow()
+
+    buckets = band_buckets(sig)
+    candidates = (select(SubmissionFingerprint.submission_id, SubmissionFingerprint.signature)
+                  .where(SubmissionFingerprint.submission_id.in_(
+                      select(SimilarityBucket.submission_id)
+                      .where(SimilarityBucket.assignment_id == submission.assignment_id,
+                             tuple_(SimilarityBucket.band, SimilarityBucket.bucket).in_(buckets)))))
+    threshold = _threshold()
+    pairs = []
+    for other_id, blob in db.session.execute(candidates):
+        similarity = estimate(sig, _unpack(blob))
+        if similarity >= threshold:
+            first, second = sorted((submission.id, other_id))
+            pairs.append({'assignment_id': submission.assignment_id, 'first_id': first, 'second_id': second,
+                          'similarity': similarity})
+    db.session.execute(insert(SimilarityBucket), [
+        {'assignment_id': submission.assignment_id, 'band': band, 'bucket': bucket, 'submission_id': submission.id}
+        for band, bucket in buckets])
+    if pairs:
+        db.session.execute(insert(SimilarityPair), pairs)
+    return len(pairs)
+
+
+def rebuild(assignment_id):
+    """Fingerprint every submission of an assignment and find all similar pairs.
+
+    Candidate pairs come from one self-join on the bucket table, so the
+    work is near-linear in the number of submissions. Returns
+    ``(indexed, candidates, pairs, seconds)``.
+    """
+    started = time.perf_counter()
+    submission_ids = select(Submission.id).where(Submission.assignment_id == assignment_id)
+    _forget(submission_ids)
+    SubmissionFingerprint.query.filter_by(assignment_id=assignment_id).delete(synchronize_session=False)
+
+    signatures = {}
+    fingerprints_rows = []
+    bucket_rows = []
+    for submission_id, code in (db.session.query(Submission.id, Submission.code_text)
+                                .filter_by(assignment_id=assignment_id).yield_per(500)):
+        sig, token_count = _signature_for(code)
+        if sig is None:
+            continue
+        signatures[submission_id] = sig
+        fingerprints_rows.append({'submission_id': submission_id, 'assignment_id': assignment_id,
+                                  'token_count': token_count, 'signature': _SIGNATURE.pack(*sig),
+                                  'updated_at': datetime.utcnow()})
+        bucket_rows.extend({'assignment_id': assignment_id, 'band': band, 'bucket': bucket, 'submission_id': submission_id}
+                           for band, bucket in band_buckets(sig))
+    if fingerprints_rows:
+        db.session.execute(insert(SubmissionFingerprint), fingerprints_rows)
+        db.session.execute(insert(SimilarityBucket), bucket_rows)
+
+    first, second = aliased(SimilarityBucket), aliased(SimilarityBucket)
+    candidates = (db.session.query(first.submission_id, second.submission_id)
+                  .join(second, (first.assignment_id == second.assignment_id) & (first.band == second.band)
+                        & (first.bucket == second.bucket) & (first.submission_id < second.submission_id))
+                  .filter(first.assignment_id == assignment_id)
+                  .distinct()
+                  .all())
+    threshold = _threshold()
+    pairs = []
+    for first_id, second_id in candidates:
+        similarity = estimate(signatures[first_id], signatures[second_id])
+        if similarity >= threshold:
+            pairs.append({'assignment_id': assignment_id, 'first_id': first_id, 'second_id': second_id,
+                          'similarity': similarity})
+    if pairs:
+        db.session.execute(insert(SimilarityPair), pairs)
+    db.session.commit()
+    return len(signatures), len(candidates), len(pairs), time.perf_counter() - started
+
+
+def report(assignment_id, min_similarity=0.8, limit=200):
+    """Most similar pairs for an assignment, with both authors' usernames."""
+    first, second = aliased(Submission), aliased(Submission)
+    first_user, second_user = aliased(User), aliased(User)
+    rows = (db.session.query(SimilarityPair.similarity, first.id, first_user.username, second.id, second_user.username)
+            .join(first, first.id == SimilarityPair.first_id)
+            .join(second, second.id == SimilarityPair.second_id)
+            .join(first_user, first_user.id == first.user_id)
+            .join(second_user, second_user.id == second.user_id)
+            .filter(SimilarityPair.assignment_id == assignment_id, SimilarityPair.similarity >= min_similarity)
+            .order_by(SimilarityPair.similarity.desc(), SimilarityPair.id)
+            .limit(limit)
+            .all())
+    return [SimilarPair(*row) for row in rows]
+
+
+def clear():
+    counts = {}
+    counts['similarity pairs'] = SimilarityPair.query.delete(synchronize_session=False)
+    counts['similarity buckets'] = SimilarityBucket.query.delete(synchronize_session=False)
+    counts['fingerprints'] = SubmissionFingerprint.query.delete(synchronize_session=False)
+    return counts
@@ -1,49 +1,22 @@
-from flask import render_template, flash, redirect, url_for, request
-from datetime import datetime, timedelta
+from flask import render_template, flash, redirect, url_for, request, current_app, make_response
+from datetime import datetime
 from flask_login import login_required, current_user
 import os
-import re
-from pygments import highlight
-from pygments.lexers import PythonLexer
-from pygments.formatters import HtmlFormatter
-from app import db
+from app import db, grader, similarity
 from app.student import bp
 from app.student.forms import SubmissionForm
+from app.lessons import render_lesson_html
+from app.scores import score_history
+from app.leaderboard import leaderboard_cache, ranked_users, rank_of, rank_history, page_ranks
+from app.highlighting import get_highlighted, highlight_options, stylesheet
+from app.search import find, KINDS
 from app.models import Day, Lesson, Note, Assignment, Submission, User, Program
 
-def sanitize_html_content(html_content):
-    """Extract styles and body content from HTML while preserving functionality."""
-    # Extract <style> tags from <head>
-    style_matches = re.findall(r'<style[^>]*>(.*?)</style>', html_content, re.DOTALL | re.IGNORECASE)
-    styles = ''.join(f'<style>{style}</style>' for style in style_matches)
-    
-    # Extract content between <body> tags
-    body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.DOTALL | re.IGNORECASE)
-    if body_match:
-        body_content = body_match.group(1)
-    else:
-        # If no body tags, remove html/head tags and keep everything else
-        body_content = re.sub(r'</?html[^>]*>', '', html_content, flags=re.IGNORECASE)
-        body_content = re.sub(r'</?head[^>]*>', '', body_content, flags=re.IGNORECASE)
-        body_content = re.sub(r'</?title[^>]*>.*?</title>', '', body_content, flags=re.IGNORECASE | re.DOTALL)
-    
-    # Combine styles and body content
-    return styles + body_content
-
 @bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get submissions from the last 30 days
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    submissions = Submission.query.filter_by(user_id=current_user.id).filter(Submission.submitted_at >= thirty_days_ago).order_by(Submission.submitted_at).all()
-    # Prepare data for chart
-    chart_dates = []
-    chart_scores = []
-    for sub in submissions:
-        if sub.score is not None:
-            chart_dates.append(sub.submitted_at.strftime('%Y-%m-%d'))
-            percentage = (sub.score / sub.assignment.max_score) * 100
-            chart_scores.append(round(percentage, 2))
+    # Submissions from the last 30 days and their chart series
+    submissions, chart_dates, chart_scores = score_history(current_user.id)
     return render_template('student/dashboard.html', submissions=submissions, chart_dates=chart_dates, chart_scores=chart_scores)
 
 @bp.route('/notes')
@@ -68,9 +41,7 @@ def view_lesson(lesson_id):
     html_content = None
     if lesson.html_file:
         try:
-            with open(os.path.join('app', 'static', lesson.html_file), 'r', encoding='utf-8') as f:
-                html_content = f.read()
-                html_content = sanitize_html_content(html_content)
+            html_content = render_lesson_html(current_app, lesson.html_file)
         except FileNotFoundError:
             html_content = "<p>HTML file not found.</p>"
     return render_template('student/lesson_detail.html', lesson=lesson, notes=notes, html_content=html_content)
@@ -79,16 +50,27 @@ def view_lesson(lesson_id):
 @login_required
 def view_program(program_id):
     program = Program.query.get_or_404(program_id)
-    code_content = None
+    options = highlight_options(current_app)
     highlighted_code = None
     if program.python_file:
         try:
-            with open(os.path.join('app', 'static', program.python_file), 'r', encoding='utf-8') as f:
-                code_content = f.read()
-                highlighted_code = highlight(code_content, PythonLexer(), HtmlFormatter(style='monokai', noclasses=True))
+            highlighted_code = get_highlighted(os.path.join(current_app.static_folder, program.python_file), **options)
         except FileNotFoundError:
             highlighted_code = "<pre><code># Python file not found.</code></pre>"
-    return render_template('student/program_detail.html', program=program, highlighted_code=highlighted_code)
+    css_version = stylesheet(options['style'])[1] if options['css_classes'] else None
+    return render_template('student/program_detail.html', program=program, highlighted_code=highlighted_code, css_version=css_version)
+
+@bp.route('/programs/highlight.css')
+def highlight_css():
+    css, version = stylesheet(highlight_options(current_app)['style'])
+    response = make_response(css)
+    response.mimetype = 'text/css'
+    response.set_etag(version)
+    if request.args.get('v') == version:
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response.make_conditional(request)
 
 @bp.route('/notes/<int:id>')
 @login_required
@@ -96,6 +78,16 @@ def view_note(id):
     note = Note.query.get_or_404(id)
     return render_template('student/note_detail.html', note=note)
 
+@bp.route('/search')
+@login_required
+def search():
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('kind') if request.args.get('kind') in KINDS else None
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = find(query, kind, page, current_app.config['SEARCH_PER_PAGE']) if query else ([], False)
+    return render_template('student/search.html', title='Search', query=query, kind=kind, kinds=KINDS,
+                           results=results, page=page, has_next=has_next)
+
 @bp.route('/assignments')
 @login_required
 def list_assignments():
@@ -124,7 +116,11 @@ def submit_assignment(id):
             submission = Submission(user_id=current_user.id, assignment_id=id, code_text=form.code_text.data)
             db.session.add(submission)
             flash('Your submission has been received.')
+        similarity.index_submission(submission)
         db.session.commit()
+        if current_app.config['AUTOGRADE_ON_SUBMIT'] and assignment.test_cases.count():
+            grader.schedule(current_app._get_current_object(), [submission.id])
+            flash('Your code is being run against the test cases; your score will appear shortly.')
         return redirect(url_for('student.view_assignment', id=id))
     if submission:
         form.code_text.data = submission.code_text
@@ -133,25 +129,28 @@ def submit_assignment(id):
 @bp.route('/leaderboard')
 @login_required
 def leaderboard():
-    users = User.query.filter(User.role != 'admin').order_by(User.total_score.desc()).all()
-    return render_template('student/leaderboard.html', users=users)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['LEADERBOARD_PER_PAGE']
+    if page == 1 and per_page <= leaderboard_cache.size:
+        users = leaderboard_cache.top()[:per_page]
+        has_next = len(users) == per_page
+    else:
+        rows = ranked_users().offset((page - 1) * per_page).limit(per_page + 1).all()
+        users = rows[:per_page]
+        has_next = len(rows) > per_page
+    ranks = page_ranks([user['total_score'] if isinstance(user, dict) else user.total_score for user in users],
+                       (page - 1) * per_page)
+    return render_template('student/leaderboard.html', users=users, page=page, has_next=has_next,
+                           ranks=ranks, my_rank=rank_of(current_user))
 
 @bp.route('/profile/<username>')
 @login_required
 def user_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    # Get submissions from the last 30 days
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    submissions = Submission.query.filter_by(user_id=user.id).filter(Submission.submitted_at >= thirty_days_ago).order_by(Submission.submitted_at).all()
-    # Prepare data for chart
-    chart_dates = []
-    chart_scores = []
-    for sub in submissions:
-        if sub.score is not None:
-            chart_dates.append(sub.submitted_at.strftime('%Y-%m-%d'))
-            percentage = (sub.score / sub.assignment.max_score) * 100
-            chart_scores.append(round(percentage, 2))
-    return render_template('student/profile.html', user=user, submissions=submissions, chart_dates=chart_dates, chart_scores=chart_scores)
+    # Submissions from the last 30 days and their chart series
+    submissions, chart_dates, chart_scores = score_history(user.id)
+    return render_template('student/profile.html', user=user, submissions=submissions, chart_dates=chart_dates, chart_scores=chart_scores,
+                           rank=rank_of(user), rank_snapshots=rank_history(user.id, limit=10))
 
 @bp.route('/submission/<int:id>')
 @login_required
@@ -0,0 +1,122 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; avatars are then served at full size
+    Image = None
+
+SIZES = (48, 128, 256)
+FORMATS = (('jpg', 'JPEG', {'quality': 85, 'optimize': True}),
+           ('webp', 'WEBP', {'quality': 80, 'method': 4}))
+
+_executor = None
+_executor_lock = threading.Lock()
+_ready = set()
+
+
+def _thumbnailable(path):
+    # Only content-addressed uploads are immutable, so only they get variants
+    return bool(path) and path.startswith('uploads/cas/')
+
+
+def variant_path(path, size, extension):
+    """Static path of the ``size`` px ``extension`` variant of an uploaded image."""
+    return f'{os.path.splitext(path)[0]}_{size}.{extension}'
+
+
+def variant_paths(path):
+    if not _thumbnailable(path):
+        return []
+    return [variant_path(path, size, extension) for size in SIZES for extension, _, _ in FORMATS]
+
+
+def generate(static_folder, path):
+    """Decode ``path`` once and write every size/format variant next to it."""
+    with Image.open(os.path.join(static_folder, path)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size in SIZES:
+            resized = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            for extension, fmt, options in FORMATS:
+                target = os.path.join(static_folder, variant_path(path, size, extension))
+                tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+                resized.save(tmp, fmt, **options)
+                os.replace(tmp, target)
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('THUMBNAIL_WORKERS', 2),
+                                           thread_name_prefix='thumbnails')
+        return _executor
+
+
+def schedule(app, path):
+    """Queue thumbnail generation for an uploaded image without blocking the request."""
+    if Image is None or not _thumbnailable(path):
+        return None
+    static_folder = app.static_folder
+    logger = app.logger
+
+    def run():
+        try:
+            generate(static_folder, path)
+        except Exception as e:
+            logger.warning(f"Thumbnail generation failed for {path}: {str(e)}")
+
+    return _get_executor(app).submit(run)
+
+
+def forget(paths):
+    """Drop cached availability for variants that have been deleted."""
+    _ready.difference_update(paths)
+
+
+def _available(static_folder, path):
+    if path in _ready:
+        return True
+    if os.path.exists(os.path.join(static_folder, path)):
+        _ready.add(path)
+        return True
+    return False
+
+
+def init_app(app):
+    static_folder = app.static_folder
+
+    def avatar_path(profile_pic):
+        if not profile_pic:
+            return 'default_profile_pic.jpg'
+        return profile_pic if profile_pic.startswith('uploads/') else f'uploads/{profile_pic}'
+
+    def avatar_srcset(profile_pic, extension='jpg'):
+        """``srcset`` of the generated variants, or '' if there are none yet."""
+        path = avatar_path(profile_pic)
+        if not _thumbnailable(path):
+            return ''
+        candidates = []
+        for size in SIZES:
+            variant = variant_path(path, size, extension)
+            if _available(static_folder, variant):
+                candidates.append(f"{url_for('static', filename=variant)} {size}w")
+        return ', '.join(candidates)
+
+    def avatar_url(profile_pic, size):
+        """Smallest generated JPEG variant covering ``size`` px, else the original."""
+        path = avatar_path(profile_pic)
+        if _thumbnailable(path):
+            for variant_size in SIZES:
+                if variant_size >= size:
+                    variant = variant_path(path, variant_size, 'jpg')
+                    if _available(static_folder, variant):
+                        return url_for('static', filename=variant)
+                    break
+        return url_for('static', filename=path)
+
+    @app.context_processor
+    def avatar_helpers():
+        return {'avatar_url': avatar_url, 'avatar_srcset': avatar_srcset}
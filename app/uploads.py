@@ -0,0 +1,296 @@
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from flask import current_app, flash, redirect, request
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+from app import db
+from app.models import Lesson, Program, User, StoredFile
+from app import thumbnails
+from app.metrics import uploads_total, upload_bytes_total
+
+CAS_PREFIX = 'uploads/cas/'
+CHUNK_SIZE = 64 * 1024
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+
+
+class UploadError(ValueError):
+    """An upload was rejected while it was being received."""
+
+
+def _text_error(head):
+    if b'\x00' in head:
+        return 'File does not look like text.'
+    return None
+
+
+def _image_error(head):
+    if head.startswith(IMAGE_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP'):
+        return None
+    return 'File is not a JPEG, PNG, GIF or WebP image.'
+
+
+# kind -> (allowed extensions, config key of the size limit, content check on the first chunk)
+UPLOAD_KINDS = {
+    'lesson': (('.html',), 'MAX_LESSON_UPLOAD', _text_error),
+    'program': (('.py',), 'MAX_PROGRAM_UPLOAD', _text_error),
+    'profile_pic': (('.jpg', '.jpeg', '.png', '.gif', '.webp'), 'MAX_PROFILE_PIC_UPLOAD', _image_error),
+}
+
+
+def init_app(app):
+    @app.errorhandler(RequestEntityTooLarge)
+    def upload_too_large(e):
+        limit = app.config.get('MAX_CONTENT_LENGTH')
+        flash(f'Upload is too large (limit {_format_size(limit)}).' if limit else 'Upload is too large.', 'danger')
+        return redirect(request.url)
+
+
+def _format_size(size):
+    if size >= 1024 * 1024:
+        return f'{round(size / (1024 * 1024), 1):g} MB'
+    return f'{round(size / 1024, 1):g} KB'
+
+
+def _static_path(path):
+    """Normalise a stored upload reference to a path relative to the static folder."""
+    return path if path.startswith('uploads/') else f'uploads/{path}'
+
+
+def upload_name(path):
+    """Path relative to the uploads folder, as stored in ``User.profile_pic``."""
+    return path[len('uploads/'):] if path.startswith('uploads/') else path
+
+
+def is_stored(path):
+    return bool(path) and _static_path(path).startswith(CAS_PREFIX)
+
+
+def _cas_path(digest, extension):
+    return f'{CAS_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def _acquire(path, digest, size, count=1):
+    # One upsert, so two first uploads of the same file cannot both try to insert the row
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    db.session.execute(
+        insert(StoredFile)
+        .values(sha256=digest, path=path, size=size, refcount=count, created_at=datetime.utcnow())
+        .on_conflict_do_update(index_elements=[StoredFile.path],
+                               set_={'refcount': StoredFile.refcount + count}))
+
+
+def _store_stream(stream, extension, max_size=None, check=None, count=1):
+    """Copy ``stream`` into the store while hashing it and take ``count`` references; returns (path, digest, size).
+
+    Raises UploadError as soon as ``max_size`` is exceeded or ``check``
+    rejects the first chunk; the partial temp file is removed.
+    """
+    static_folder = current_app.static_folder
+    tmp_dir = os.path.join(static_folder, CAS_PREFIX, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if check and size == 0:
+                    error = check(chunk)
+                    if error:
+                        raise UploadError(error)
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise UploadError(f'File is larger than {_format_size(max_size)}.')
+                hasher.update(chunk)
+                out.write(chunk)
+        digest = hasher.hexdigest()
+        path = _cas_path(digest, extension)
+        final_path = os.path.join(static_folder, path)
+        # The reference is taken before the file is looked at: from here on cleanup cannot
+        # delete the row, and if it removed the file just before, the temp copy replaces it
+        _acquire(path, digest, size, count)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, digest, size
+
+
+def store_upload(file_storage, kind=None):
+    """Save an uploaded file in the content-addressed store.
+
+    The file is streamed to disk in chunks while it is hashed and ends up
+    at ``uploads/cas/ab/cd/<sha256><ext>``; identical uploads share one
+    copy. With a ``kind`` from UPLOAD_KINDS the extension, size and leading
+    bytes are validated on the way and UploadError is raised on rejection.
+    The reference count is bumped in the current session, so it is
+    committed (or rolled back) together with the row that uses the file.
+    Returns the path relative to the static folder.
+    """
+    extension = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lower()
+    max_size = check = None
+    labels = (kind or 'other',)
+    try:
+        if kind:
+            extensions, limit_key, check = UPLOAD_KINDS[kind]
+            if extension not in extensions:
+                raise UploadError(f"Only {', '.join(extensions)} files are allowed.")
+            max_size = current_app.config.get(limit_key)
+        path, digest, size = _store_stream(file_storage.stream, extension, max_size, check)
+    except UploadError:
+        uploads_total.inc(labels=labels + ('rejected',))
+        raise
+    uploads_total.inc(labels=labels + ('stored',))
+    upload_bytes_total.inc(size, labels=labels)
+    return path
+
+
+def release(paths):
+    """Drop one reference per entry in ``paths`` in the current session."""
+    counts = Counter(_static_path(path) for path in paths if is_stored(path))
+    for path, count in counts.items():
+        (StoredFile.query.filter_by(path=path)
+         .update({StoredFile.refcount: StoredFile.refcount - count}, synchronize_session=False))
+
+
+def referenced_uploads(paths):
+    """Return the subset of ``paths`` still used by a lesson, program or profile."""
+    paths = {_static_path(path) for path in paths}
+    if not paths:
+        return set()
+    names = {upload_name(path) for path in paths}
+    used = set()
+    used.update(row[0] for row in db.session.query(Lesson.html_file).filter(Lesson.html_file.in_(paths)))
+    used.update(row[0] for row in db.session.query(Program.python_file).filter(Program.python_file.in_(paths)))
+    used.update(_static_path(row[0]) for row in db.session.query(User.profile_pic).filter(User.profile_pic.in_(names)))
+    return used
+
+
+def _remove_file(full_path):
+    removed = 0
+    path = os.path.relpath(full_path, current_app.static_folder).replace(os.sep, '/')
+    variants = thumbnails.variant_paths(path)
+    thumbnails.forget(variants)
+    candidates = [full_path] + glob.glob(glob.escape(full_path) + '.*.html')
+    candidates += [os.path.join(current_app.static_folder, variant) for variant in variants]
+    for candidate in candidates:
+        try:
+            os.remove(candidate)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            current_app.logger.warning(f"Could not remove upload {candidate}: {str(e)}")
+    return removed
+
+
+def remove_unreferenced(paths):
+    """Delete upload files (and derived artifacts) that nothing points to any more.
+
+    Stored files go once their reference count reaches zero; legacy flat
+    uploads are checked against the lesson, program and user tables.
+    """
+    paths = {_static_path(path) for path in paths if path}
+    stored = {path for path in paths if is_stored(path)}
+    removed = 0
+    for path in stored:
+        deleted = (StoredFile.query.filter(StoredFile.path == path, StoredFile.refcount <= 0)
+                   .delete(synchronize_session=False))
+        # The file goes while the delete still holds the row, so an upload of the same
+        # content waits for this commit and then finds the file missing and puts it back
+        if deleted:
+            removed += _remove_file(os.path.join(current_app.static_folder, path))
+        db.session.commit()
+    legacy = paths - stored
+    for path in legacy - referenced_uploads(legacy):
+        removed += _remove_file(os.path.join(current_app.static_folder, path))
+    return removed
+
+
+def schedule_cleanup(paths):
+    """Remove unreferenced uploads in a background thread after a delete commits."""
+    paths = [path for path in paths if path]
+    if not paths:
+        return None
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                removed = remove_unreferenced(paths)
+                app.logger.info(f"Upload cleanup removed {removed} file(s)")
+            except Exception as e:
+                app.logger.warning(f"Upload cleanup failed: {str(e)}")
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, name='upload-cleanup', daemon=True)
+    thread.start()
+    return thread
+
+
+def sync_refcounts():
+    """Recompute every StoredFile.refcount from the rows that reference it."""
+    counts = Counter()
+    counts.update(row[0] for row in db.session.query(Lesson.html_file).filter(Lesson.html_file.like(CAS_PREFIX + '%')))
+    counts.update(row[0] for row in db.session.query(Program.python_file).filter(Program.python_file.like(CAS_PREFIX + '%')))
+    counts.update(_static_path(row[0]) for row in db.session.query(User.profile_pic).filter(User.profile_pic.like(upload_name(CAS_PREFIX) + '%')))
+    for stored in StoredFile.query.all():
+        stored.refcount = counts.get(stored.path, 0)
+    db.session.commit()
+
+
+def dedupe_existing_uploads():
+    """Move every referenced flat upload into the store and repoint its rows.
+
+    Returns ``(moved, bytes_saved)``. Original files are removed once no
+    row refers to them.
+    """
+    static_folder = current_app.static_folder
+    references = []
+    references += [(row, 'html_file', row.html_file) for row in Lesson.query.filter(Lesson.html_file.isnot(None))]
+    references += [(row, 'python_file', row.python_file) for row in Program.query.filter(Program.python_file.isnot(None))]
+    references += [(row, 'profile_pic', row.profile_pic) for row in User.query.filter(User.profile_pic.isnot(None))]
+
+    stored_by_source = {}
+    originals = set()
+    moved = 0
+    for row, column, value in references:
+        source = _static_path(value)
+        if is_stored(source):
+            continue
+        full_path = os.path.join(static_folder, source)
+        if source not in stored_by_source:
+            if not os.path.isfile(full_path):
+                continue
+            with open(full_path, 'rb') as f:
+                path, digest, size = _store_stream(f, os.path.splitext(source)[1].lower(), count=0)
+            stored_by_source[source] = path
+            originals.add(source)
+        path = stored_by_source[source]
+        setattr(row, column, upload_name(path) if column == 'profile_pic' else path)
+        moved += 1
+    db.session.commit()
+    sync_refcounts()
+
+    original_bytes = 0
+    for source in originals:
+        full_path = os.path.join(static_folder, source)
+        original_bytes += os.path.getsize(full_path)
+        _remove_file(full_path)
+    stored_bytes = sum(os.path.getsize(os.path.join(static_folder, path)) for path in set(stored_by_source.values()))
+    return moved, original_bytes - stored_bytes
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
+from app import db
+from app.models import User
+
+
+class UserCache:
+    """Short-lived per-worker cache of logged-in users' column values.
+
+    ``load()`` rebuilds the User from cached values and merges it into the
+    session without a SELECT, so ``current_user`` behaves like a normally
+    loaded row (attribute changes are flushed, relationships lazy-load).
+    Code that changes a user calls ``invalidate()`` so this worker sees the
+    change on the next request. Other workers re-check ``User.version``
+    once an entry is ``ttl`` seconds old and reload it only if it changed.
+    Bulk UPDATEs of the user table must bump the version themselves.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def configure(self, max_entries=None, ttl=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl is not None:
+                self.ttl = ttl
+            self._entries.clear()
+
+    def load(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id) if self.ttl > 0 else None
+            fresh = entry is not None and now - entry[0] < self.ttl
+        values = entry[1] if entry else None
+        if values is not None and not fresh:
+            # Once per ttl window: one integer instead of the whole row, and the entry lives on if unchanged
+            version = db.session.scalar(select(User.version).where(User.id == user_id))
+            values = values if version == values['version'] else None
+        with self._lock:
+            if values is not None:
+                if not fresh:
+                    self._entries[user_id] = (now, values)
+                self._entries.move_to_end(user_id)
+            if fresh:
+                self.hits += 1
+            elif values is not None:
+                self.revalidations += 1
+            else:
+                self.misses += 1
+        if values is not None:
+            user = User(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        user = db.session.get(User, user_id)
+        if user is not None and self.ttl > 0:
+            values = {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs}
+            with self._lock:
+                self._entries[user_id] = (now, values)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                if self._entries.pop(user_id, None) is not None:
+                    self.invalidations += 1
+        # A bulk UPDATE leaves the instance in this session (often current_user) with the old values
+        for user_id in user_ids:
+            user = db.session.identity_map.get(db.session.identity_key(User, user_id))
+            if user is not None:
+                db.session.expire(user)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.revalidations + self.misses
+            return {
+                'entries': len(self._entries),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'queries_saved': self.hits,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+user_cache = UserCache()
+
+
+def init_app(app):
+    user_cache.configure(max_entries=app.config.get('USER_CACHE_SIZE', 1024),
+                         ttl=app.config.get('USER_CACHE_TTL', 30))
@@ -1,10 +1,114 @@
 import os
 
+# Connection pool defaults per deployment; pick one with DB_POOL_PROFILE and
+# override single values with DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+DB_POOL_PROFILES = {
+    'development': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 30, 'pool_recycle': -1},
+    # Render closes idle Postgres connections, so recycle well before that and ping on checkout
+    'production': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 10, 'pool_recycle': 280},
+    # Free-tier databases with a low connection limit
+    'small': {'pool_size': 2, 'max_overflow': 3, 'pool_timeout': 10, 'pool_recycle': 280},
+    # CLI commands and background workers
+    'worker': {'pool_size': 2, 'max_overflow': 0, 'pool_timeout': 30, 'pool_recycle': 280},
+}
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``uri`` from DB_POOL_PROFILE and the DB_* overrides."""
+    is_sqlite = uri.startswith('sqlite')
+    pre_ping = os.environ.get('DB_POOL_PRE_PING', 'false' if is_sqlite else 'true')
+    options = {'pool_pre_ping': pre_ping.lower() in ['true', 'on', '1']}
+    if is_sqlite and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri):
+        # In-memory databases use a single shared connection, not a sized pool
+        return options
+    profile = os.environ.get('DB_POOL_PROFILE') or ('development' if is_sqlite else 'production')
+    options.update(DB_POOL_PROFILES[profile])
+    for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+        value = os.environ.get(f'DB_{key.upper()}')
+        if value:
+            options[key] = int(value)
+    return options
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # SQLite databases get WAL journaling and the pragmas in app/dbhealth.py
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', 'true').lower() in ['true', 'on', '1']
+
+    # Sanitized lesson HTML cache (set LESSON_CACHE_DIR to share it between workers)
+    LESSON_CACHE_SIZE = int(os.environ.get('LESSON_CACHE_SIZE') or 128)
+    LESSON_CACHE_DIR = os.environ.get('LESSON_CACHE_DIR')
+
+    # Program highlighting; class-based CSS keeps pages small and the stylesheet cacheable
+    PYGMENTS_STYLE = os.environ.get('PYGMENTS_STYLE') or 'monokai'
+    PYGMENTS_CSS_CLASSES = os.environ.get('PYGMENTS_CSS_CLASSES', 'true').lower() in ['true', 'on', '1']
+
+    # Leaderboard: cached top-N per worker, paging for the rest
+    LEADERBOARD_CACHE_SIZE = int(os.environ.get('LEADERBOARD_CACHE_SIZE') or 50)
+    LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL') or 60)
+    LEADERBOARD_PER_PAGE = int(os.environ.get('LEADERBOARD_PER_PAGE') or 50)
+
+    # Background workers that resize uploaded profile pictures
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS') or 2)
+
+    # Upload limits in bytes; requests over MAX_CONTENT_LENGTH are refused before the body is read
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024)
+    MAX_LESSON_UPLOAD = int(os.environ.get('MAX_LESSON_UPLOAD') or 5 * 1024 * 1024)
+    MAX_PROGRAM_UPLOAD = int(os.environ.get('MAX_PROGRAM_UPLOAD') or 1024 * 1024)
+    MAX_PROFILE_PIC_UPLOAD = int(os.environ.get('MAX_PROFILE_PIC_UPLOAD') or 5 * 1024 * 1024)
     
+    # Logged-in users are served from a per-worker cache for this many seconds, then re-checked against User.version (0 disables)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 30)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+
+    # Per-request SQL profiling: Server-Timing header, slow request log, /admin/profiler summary
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'true').lower() in ['true', 'on', '1']
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() in ['true', 'on', '1']
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS') or 500)
+    SLOW_REQUEST_QUERIES = int(os.environ.get('SLOW_REQUEST_QUERIES') or 50)
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 100)
+
+    # Prometheus-style /metrics; set METRICS_TOKEN to require "Authorization: Bearer <token>"
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Full-text search over notes, lessons, programs and assignments
+    SEARCH_PER_PAGE = int(os.environ.get('SEARCH_PER_PAGE') or 20)
+    SEARCH_MAX_INDEXED_CHARS = int(os.environ.get('SEARCH_MAX_INDEXED_CHARS') or 200000)
+
+    # Auto-grader: each test case runs in a fresh interpreter with these limits, one per core
+    GRADER_WORKERS = int(os.environ.get('GRADER_WORKERS') or os.cpu_count() or 2)
+    GRADER_CPU_SECONDS = int(os.environ.get('GRADER_CPU_SECONDS') or 2)
+    GRADER_WALL_SECONDS = int(os.environ.get('GRADER_WALL_SECONDS') or 5)
+    GRADER_MEMORY_MB = int(os.environ.get('GRADER_MEMORY_MB') or 256)
+    GRADER_OUTPUT_LIMIT = int(os.environ.get('GRADER_OUTPUT_LIMIT') or 64 * 1024)
+    GRADER_RUN_AS_UID = int(os.environ.get('GRADER_RUN_AS_UID') or 65534)
+    GRADER_BATCH_SIZE = int(os.environ.get('GRADER_BATCH_SIZE') or 100)
+    AUTOGRADE_ON_SUBMIT = os.environ.get('AUTOGRADE_ON_SUBMIT', 'true').lower() in ['true', 'on', '1']
+
+    # Copied-code detection: pairs at or above this estimated similarity (percent) are kept for the report
+    SIMILARITY_MIN_PERCENT = int(os.environ.get('SIMILARITY_MIN_PERCENT') or 50)
+    SIMILARITY_MIN_TOKENS = int(os.environ.get('SIMILARITY_MIN_TOKENS') or 30)
+
+    # Password hashing; existing hashes are upgraded on the next successful login when this changes
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted (0 when serving directly; render.yaml sets 1)
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR') or 0)
+
+    # Login throttling: token buckets per client IP, per IP and username, and per account across all IPs
+    # (memory://, sqlite:///path or redis://)
+    LOGIN_RATE_LIMIT = os.environ.get('LOGIN_RATE_LIMIT', 'true').lower() in ['true', 'on', '1']
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL') or 'memory://'
+    LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST') or 20)
+    LOGIN_IP_PER_MINUTE = int(os.environ.get('LOGIN_IP_PER_MINUTE') or 10)
+    LOGIN_USERNAME_BURST = int(os.environ.get('LOGIN_USERNAME_BURST') or 5)
+    LOGIN_USERNAME_PER_MINUTE = int(os.environ.get('LOGIN_USERNAME_PER_MINUTE') or 5)
+    LOGIN_ACCOUNT_BURST = int(os.environ.get('LOGIN_ACCOUNT_BURST') or 50)
+    LOGIN_ACCOUNT_PER_MINUTE = int(os.environ.get('LOGIN_ACCOUNT_PER_MINUTE') or 10)
+
     # Email configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
@@ -12,6 +116,17 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or os.environ.get('MAIL_USERNAME')
+
+    # Outbox: emails are queued in the database and sent by a background worker with retries
+    OUTBOX_WORKER = os.environ.get('OUTBOX_WORKER', 'true').lower() in ['true', 'on', '1']
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 50)
+    OUTBOX_POLL_INTERVAL = int(os.environ.get('OUTBOX_POLL_INTERVAL') or 15)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 6)
+    OUTBOX_RETRY_BASE = int(os.environ.get('OUTBOX_RETRY_BASE') or 30)
+    OUTBOX_RETRY_MAX = int(os.environ.get('OUTBOX_RETRY_MAX') or 3600)
+
+    # Grade/feedback/assignment notifications are collected and emailed as one digest per student
+    NOTIFICATION_DIGEST_INTERVAL = int(os.environ.get('NOTIFICATION_DIGEST_INTERVAL') or 900)
     
     # Production vs Development detection
     if not MAIL_USERNAME or not MAIL_PASSWORD:
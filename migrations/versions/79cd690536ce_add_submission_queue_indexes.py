@@ -0,0 +1,35 @@
+"""add submission queue indexes
+
+Revision ID: 79cd690536ce
+Revises: 9f79cc32fd70
+Create Date: 2026-10-18 09:12:41.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '79cd690536ce'
+down_revision = '9f79cc32fd70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('submission', schema=None) as batch_op:
+        batch_op.create_index('ix_submission_assignment_id_submitted_at', ['assignment_id', 'submitted_at', 'id'], unique=False)
+        batch_op.create_index('ix_submission_user_id_submitted_at', ['user_id', 'submitted_at', 'id'], unique=False)
+
+    # Partial index backing the "ungraded" grading queue
+    op.create_index('ix_submission_ungraded', 'submission', ['submitted_at', 'id'], unique=False,
+                    postgresql_where=sa.text('score IS NULL'),
+                    sqlite_where=sa.text('score IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_submission_ungraded', table_name='submission')
+
+    with op.batch_alter_table('submission', schema=None) as batch_op:
+        batch_op.drop_index('ix_submission_user_id_submitted_at')
+        batch_op.drop_index('ix_submission_assignment_id_submitted_at')
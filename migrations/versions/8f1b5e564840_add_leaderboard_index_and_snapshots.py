@@ -0,0 +1,45 @@
+"""add leaderboard index and snapshots
+
+Revision ID: 8f1b5e564840
+Revises: 79cd690536ce
+Create Date: 2026-10-18 10:04:17.228391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f1b5e564840'
+down_revision = '79cd690536ce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('leaderboard_snapshot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('total_score', sa.Integer(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('leaderboard_snapshot', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_leaderboard_snapshot_taken_at'), ['taken_at'], unique=False)
+        batch_op.create_index('ix_leaderboard_snapshot_user_id_taken_at', ['user_id', 'taken_at'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_role_total_score', ['role', 'total_score'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_role_total_score')
+
+    with op.batch_alter_table('leaderboard_snapshot', schema=None) as batch_op:
+        batch_op.drop_index('ix_leaderboard_snapshot_user_id_taken_at')
+        batch_op.drop_index(batch_op.f('ix_leaderboard_snapshot_taken_at'))
+
+    op.drop_table('leaderboard_snapshot')
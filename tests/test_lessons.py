@@ -0,0 +1,63 @@
+import glob
+import io
+import os
+import random
+import re
+
+import pytest
+
+from app.lessons import sanitize_html_content, sanitize_html_stream
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FIXTURES = sorted(glob.glob(os.path.join(ROOT, 'app', 'static', 'uploads', '*.html')))
+
+
+def regex_sanitize_html_content(html_content):
+    """The regex chain that sanitize_html_content used to run."""
+    style_matches = re.findall(r'<style[^>]*>(.*?)</style>', html_content, re.DOTALL | re.IGNORECASE)
+    styles = ''.join(f'<style>{style}</style>' for style in style_matches)
+    body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.DOTALL | re.IGNORECASE)
+    if body_match:
+        body_content = body_match.group(1)
+    else:
+        body_content = re.sub(r'</?html[^>]*>', '', html_content, flags=re.IGNORECASE)
+        body_content = re.sub(r'</?head[^>]*>', '', body_content, flags=re.IGNORECASE)
+        body_content = re.sub(r'</?title[^>]*>.*?</title>', '', body_content, flags=re.IGNORECASE | re.DOTALL)
+    return styles + body_content
+
+
+def assert_matches_regex(html):
+    expected = regex_sanitize_html_content(html)
+    assert sanitize_html_content(html) == expected
+    for chunk_size in (1, 3, 7):
+        assert sanitize_html_stream(io.StringIO(html), chunk_size=chunk_size) == expected
+
+
+@pytest.mark.parametrize('path', FIXTURES, ids=os.path.basename)
+def test_fixtures_match_regex_chain(path):
+    with open(path, encoding='utf-8') as f:
+        assert_matches_regex(f.read())
+
+
+@pytest.mark.parametrize('html', [
+    '</title</html>',
+    '<title<html>x</title>',
+    '<he<html>ad>text',
+    '<html<head>>x<title>t</title',
+    '<title>a</title</title>b',
+    '<style>a</style<style>b</style>',
+    '<body<p>x</body>',
+    '<body>unclosed',
+    '<STYLE media=x>p{}</Style><BODY class=a>hi</BODY>',
+])
+def test_malformed_html_matches_regex_chain(html):
+    assert_matches_regex(html)
+
+
+def test_random_tag_soup_matches_regex_chain():
+    rng = random.Random(3)
+    pieces = ['<style>', '</style>', '<style a=1>', '<body>', '</body>', '<BODY x>', '<html>', '</html>',
+              '<head>', '</head>', '<title>', '</title>', '<TITLE', '</title', '<html', '</html', '<head',
+              '<body', '</body', '<style', '</style', '>', '<', 'x', '\n', '<p>', '</', 'tle>']
+    for _ in range(2000):
+        assert_matches_regex(''.join(rng.choice(pieces) for _ in range(rng.randint(0, 14))))
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Assignment, Submission, User
+from app.scores import score_history
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    OUTBOX_WORKER = False
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def add_submissions(count):
+    user = User(username=f'student{count}', email=f'student{count}@example.com')
+    db.session.add(user)
+    for i in range(count):
+        assignment = Assignment(title=f'Assignment {i}', max_score=10)
+        db.session.add(Submission(author=user, assignment=assignment, score=i % 11,
+                                  submitted_at=datetime.now() - timedelta(hours=i)))
+    db.session.commit()
+    user_id = user.id
+    # Start from an empty identity map so nothing is served without a query
+    db.session.expunge_all()
+    return user_id
+
+
+def count_statements(func, *args):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = func(*args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return result, len(statements)
+
+
+def test_score_history_query_count_does_not_grow_with_submissions(app):
+    counts = []
+    for n in (1, 25):
+        user_id = add_submissions(n)
+        (submissions, chart_dates, chart_scores), statements = count_statements(score_history, user_id)
+        assert len(submissions) == n
+        assert len(chart_scores) == len(chart_dates) == n
+        counts.append(statements)
+    assert counts[0] == counts[1] == 1
@@ -0,0 +1,116 @@
+import argparse
+import gzip
+import hashlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from incremental_backup import LocalStore, backup, restore, snapshots
+
+TABLES = ("user", "submission", "note", "search_document")
+
+
+def make_row(rng, table, row_id):
+    words = " ".join(rng.choice(("print", "for", "range", "def", "return", "value", "total", "list", "x", "i"))
+                     for _ in range(rng.randint(5, 400 if table == "submission" else 60)))
+    return f"{row_id}\t{table}-{rng.getrandbits(48):x}\t{words}\t2025-01-{rng.randint(1, 28):02d} 12:00:00\n"
+
+
+def dump(tables):
+    """Bytes shaped like an uncompressed pg_dump: a header and one COPY block per table."""
+    out = io.BytesIO()
+    out.write(b"PGDMP" + bytes(range(64)))
+    for table, rows in tables.items():
+        out.write(f"COPY public.{table} (id, name, body, created_at) FROM stdin;\n".encode())
+        for row in rows.values():
+            out.write(row.encode())
+        out.write(b"\\.\n\n")
+    return out.getvalue()
+
+
+def night(rng, tables, next_id, changes, hot):
+    """Insert, update and delete a share of rows; an updated row moves to the end like a new heap tuple.
+
+    A ``hot`` share of the updates and deletes hits the newest 5% of rows,
+    the rest is spread over the whole table.
+    """
+    for table, rows in tables.items():
+        count = max(1, int(len(rows) * changes))
+        ids = list(rows)
+        recent = ids[-max(count, len(ids) // 20):]
+        picked = {rng.choice(recent) if rng.random() < hot else rng.choice(ids) for _ in range(count)}
+        for row_id in picked:
+            del rows[row_id]
+            rows[row_id] = make_row(rng, table, row_id)
+        for row_id in list(picked)[:count // 4]:
+            del rows[row_id]
+        for _ in range(count):
+            rows[next_id] = make_row(rng, table, next_id)
+            next_id += 1
+    return next_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the dedupe ratio of incremental backups over simulated nights")
+    parser.add_argument("--rows", type=int, default=20000, help="rows per table at the start")
+    parser.add_argument("--nights", type=int, default=14)
+    parser.add_argument("--changes", type=float, default=0.002, help="share of rows updated and inserted each night")
+    parser.add_argument("--hot", type=float, default=0.9, help="share of updates that hit recent rows")
+    parser.add_argument("--average-kb", type=int, default=256)
+    parser.add_argument("--files", nargs="*", help="real dumps to back up in order instead of simulated nights")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    if args.files:
+        def dumps():
+            for path in args.files:
+                with open(path, "rb") as f:
+                    yield f.read()
+    else:
+        def dumps():
+            tables = {table: {i: make_row(rng, table, i) for i in range(args.rows)} for table in TABLES}
+            next_id = args.rows
+            for day in range(args.nights):
+                if day:
+                    next_id = night(rng, tables, next_id, args.changes, args.hot)
+                yield dump(tables)
+
+    average = args.average_kb * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalStore(tmp)
+        logical = full = uploaded = chunked_seconds = 0
+        last = None
+        for day, data in enumerate(dumps(), 1):
+            full_size = len(gzip.compress(data, 6))
+            result = backup(store, io.BytesIO(data), "bench-", average, average // 4, average * 4,
+                            snapshot=f"{day:03d}")
+            logical += len(data)
+            full += full_size
+            uploaded += result.new_bytes
+            chunked_seconds += result.seconds
+            last = data
+            print(f"night {day:>3}  dump {len(data) / 2**20:7.1f} MiB  {result.chunks:>5} chunks  "
+                  f"{result.new_chunks:>5} new  uploaded {result.new_bytes / 2**20:7.2f} MiB  "
+                  f"(full gzip {full_size / 2**20:6.2f} MiB)  {len(data) / 2**20 / result.seconds:6.1f} MiB/s")
+
+        stored = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+        out = io.BytesIO()
+        started = time.perf_counter()
+        restore(store, snapshots(store, "bench-")[-1], out)
+        restored = hashlib.sha256(out.getvalue()).digest() == hashlib.sha256(last).digest()
+        print(f"\n{logical / 2**20:.1f} MiB dumped over {day} nights")
+        print(f"full gzip backups: {full / 2**20:.1f} MiB uploaded and stored")
+        print(f"incremental:       {uploaded / 2**20:.1f} MiB uploaded, {stored / 2**20:.1f} MiB stored "
+              f"(dedupe ratio {full / stored:.1f}x against full backups, {logical / stored:.1f}x against raw dumps)")
+        print(f"backup throughput {logical / 2**20 / chunked_seconds:.1f} MiB/s, "
+              f"restore of the last snapshot {'matches' if restored else 'DOES NOT MATCH'} "
+              f"({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
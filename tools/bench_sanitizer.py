@@ -0,0 +1,68 @@
+import argparse
+import base64
+import glob
+import io
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.lessons import sanitize_html_content, sanitize_html_stream
+
+
+def regex_sanitize_html_content(html_content):
+    """The regex chain that sanitize_html_content used to run."""
+    style_matches = re.findall(r'<style[^>]*>(.*?)</style>', html_content, re.DOTALL | re.IGNORECASE)
+    styles = ''.join(f'<style>{style}</style>' for style in style_matches)
+    body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.DOTALL | re.IGNORECASE)
+    if body_match:
+        body_content = body_match.group(1)
+    else:
+        body_content = re.sub(r'</?html[^>]*>', '', html_content, flags=re.IGNORECASE)
+        body_content = re.sub(r'</?head[^>]*>', '', body_content, flags=re.IGNORECASE)
+        body_content = re.sub(r'</?title[^>]*>.*?</title>', '', body_content, flags=re.IGNORECASE | re.DOTALL)
+    return styles + body_content
+
+
+def with_inline_image(html: str, size: int) -> str:
+    """Embed a base64 image of roughly ``size`` bytes, like large lesson exports."""
+    payload = base64.b64encode(os.urandom(size)).decode("ascii")
+    return html.replace("</body>", f'<img src="data:image/png;base64,{payload}"></body>', 1)
+
+
+def bench(label: str, html: str, number: int) -> None:
+    if sanitize_html_content(html) != regex_sanitize_html_content(html):
+        raise SystemExit(f"{label}: output differs from the regex implementation")
+    old = min(timeit.repeat(lambda: regex_sanitize_html_content(html), number=number, repeat=5))
+    new = min(timeit.repeat(lambda: sanitize_html_content(html), number=number, repeat=5))
+    stream = min(timeit.repeat(lambda: sanitize_html_stream(io.StringIO(html)), number=number, repeat=5))
+    print(
+        f"{label:<40} {len(html):>10} chars  "
+        f"regex {old / number * 1e6:9.1f} us  "
+        f"single-pass {new / number * 1e6:9.1f} us  "
+        f"stream {stream / number * 1e6:9.1f} us  "
+        f"x{old / new:5.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the lesson HTML sanitizers")
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=2048)
+    args = parser.parse_args()
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    files = args.files or sorted(glob.glob(os.path.join(root, "app", "static", "uploads", "*.html")))
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            html = f.read()
+        name = os.path.basename(path)
+        bench(name, html, args.number)
+        bench(f"{name} + {args.image_kb}KB image", with_inline_image(html, args.image_kb * 1024), max(1, args.number // 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from config import Config
+
+WORDS = (
+    "python variable function loop list dictionary tuple class object method string integer "
+    "float boolean import module package exception error file read write open close print input "
+    "range index slice comprehension generator iterator decorator lambda recursion sorting search "
+    "algorithm stack queue tree graph network request response database query table column row "
+    "test debug assert return yield break continue while condition branch operator expression"
+).split()
+QUERIES = ("python", "recursion tree", "dict", "decorator lambda generator", "xylophone", "sort")
+
+
+class BenchConfig(Config):
+    OUTBOX_WORKER = False
+    PROFILER_ENABLED = False
+    METRICS_ENABLED = False
+
+
+def paragraph(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def populate(db, count, body_words, rng):
+    from sqlalchemy import insert
+    from app.models import SearchDocument
+    kinds = ("note", "lesson", "program", "assignment")
+    rows = [
+        {"kind": kinds[i % 4], "ref_id": i, "title": paragraph(rng, 5), "body": paragraph(rng, body_words)}
+        for i in range(count)
+    ]
+    db.session.execute(insert(SearchDocument), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time /student/search queries over synthetic documents")
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=300, help="words per document body")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", help="an empty database to use instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        BenchConfig.SQLALCHEMY_DATABASE_URI = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        from app import create_app, db
+        from app.search import create_index, find
+        app = create_app(BenchConfig)
+        with app.app_context(), app.test_request_context():
+            db.create_all()
+            create_index()
+            started = time.perf_counter()
+            populate(db, args.documents, args.words, random.Random(42))
+            print(f"Indexed {args.documents} documents of {args.words} words in {time.perf_counter() - started:.2f}s")
+            for query in QUERIES:
+                for page in (1, 10):
+                    timings = []
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        results, _ = find(query, page=page, per_page=app.config["SEARCH_PER_PAGE"])
+                        timings.append((time.perf_counter() - started) * 1000)
+                    timings.sort()
+                    print(f"{query!r:<32} page {page:>2}  {len(results):>3} results  "
+                          f"median {statistics.median(timings):7.2f} ms  max {timings[-1]:7.2f} ms")
+            if not args.database_url:
+                db.session.remove()
+                db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
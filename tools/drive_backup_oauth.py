@@ -7,11 +7,13 @@ from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 
+from drive_stream import add_stream_arguments, stream_from_args
+
 
 SCOPES = ["https://www.googleapis.com/auth/drive"]
 
 
-def build_drive_service():
+def build_credentials():
     client_secret = os.environ.get("GDRIVE_CLIENT_SECRET_JSON")
     refresh_token = os.environ.get("GDRIVE_REFRESH_TOKEN")
     if not client_secret:
@@ -25,9 +27,21 @@ def build_drive_service():
         SCOPES,
     )
     creds.refresh(Request())
+    return creds
+
+
+def build_drive_service(creds):
     return build("drive", "v3", credentials=creds)
 
 
+def access_token(creds):
+    def get_token(refresh: bool = False) -> str:
+        if refresh or not creds.valid:
+            creds.refresh(Request())
+        return creds.token
+    return get_token
+
+
 def upload_file(service, folder_id: str, file_path: str, remote_name: str) -> str:
     file_metadata = {"name": remote_name, "parents": [folder_id]}
     media = MediaFileUpload(file_path, resumable=True)
@@ -75,18 +89,25 @@ def enforce_retention(service, folder_id: str, name_prefix: str, keep_last: int)
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--file", required=True)
+    parser.add_argument("--file")
     parser.add_argument("--folder", required=False, default=os.environ.get("GDRIVE_FOLDER_ID"))
     parser.add_argument("--name", required=True)
     parser.add_argument("--prefix", required=True)
     parser.add_argument("--keep-last", type=int, default=int(os.environ.get("GDRIVE_KEEP_LAST", "30")))
+    add_stream_arguments(parser)
     args = parser.parse_args()
 
+    if not args.stream and not args.file:
+        parser.error("--file is required unless --stream is given")
     if not args.folder:
         raise RuntimeError("Missing GDRIVE_FOLDER_ID")
 
-    service = build_drive_service()
-    upload_file(service, args.folder, args.file, args.name)
+    creds = build_credentials()
+    service = build_drive_service(creds)
+    if args.stream:
+        stream_from_args(args, access_token(creds))
+    else:
+        upload_file(service, args.folder, args.file, args.name)
     enforce_retention(service, args.folder, args.prefix, args.keep_last)
 
 
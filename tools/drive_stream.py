@@ -0,0 +1,317 @@
+"""Stream a pg_dump straight into a Google Drive resumable upload.
+
+    python tools/drive_backup_oauth.py --stream --name backup.dump.gz --prefix backup-
+
+pg_dump writes into a pipe, a second thread gzips it into fixed-size chunks
+and the main thread sends each chunk as soon as it is ready, so nothing is
+written to disk and the upload overlaps the dump. Memory is bounded by
+``--buffer-chunks`` chunks. After a failed request Drive is asked how much
+it has committed and the upload carries on from there; at the end the MD5
+of the bytes sent is checked against the one Drive reports.
+
+Run on its own with an access token, e.g. against ``tools/fake_drive.py``:
+
+    python tools/drive_stream.py --api-url http://localhost:8080 --token test \\
+        --folder backups --name test.dump.gz --dump-command "pg_dump --format=custom --compress=0 mydb"
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import queue
+import random
+import shlex
+import subprocess
+import threading
+import time
+import zlib
+from collections import namedtuple
+from urllib.parse import urlencode, urlsplit
+
+DRIVE_API_URL = "https://www.googleapis.com"
+# Drive only accepts chunks in multiples of 256 KiB, except the last one
+CHUNK_ALIGN = 256 * 1024
+READ_SIZE = 1024 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+StreamResult = namedtuple("StreamResult", "file_id size md5 dump_bytes retries seconds")
+
+
+class UploadError(RuntimeError):
+    pass
+
+
+def pg_dump_command(database_url: str) -> list:
+    # Compression happens once, in the gzip thread, instead of inside pg_dump as well
+    return ["pg_dump", "--format=custom", "--compress=0", "--no-owner", "--no-privileges", database_url]
+
+
+class _Http:
+    """Keep-alive connections per host; a connection is dropped after any error."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.connections = {}
+
+    def request(self, method: str, url: str, body: bytes = b"", headers: dict = None):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        connection = self.connections.get(key)
+        if connection is None:
+            factory = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            connection = self.connections[key] = factory(parts.netloc, timeout=self.timeout)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.headers, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            del self.connections[key]
+            raise
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections.clear()
+
+
+def _put(chunks: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _compress(process, chunks: queue.Queue, chunk_size: int, level: int, stop: threading.Event, stats: dict):
+    """Gzip the dump into ``chunk_size`` pieces; ``None`` marks the end, an exception a failure."""
+    # wbits=31 writes a gzip header and trailer, so the result is a plain .gz file
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = bytearray()
+    try:
+        while True:
+            block = process.stdout.read(READ_SIZE)
+            stats["dump_bytes"] += len(block)
+            pending += compressor.compress(block) if block else compressor.flush()
+            while len(pending) >= chunk_size:
+                if not _put(chunks, bytes(pending[:chunk_size]), stop):
+                    return
+                del pending[:chunk_size]
+            if not block:
+                break
+        if process.wait() != 0:
+            raise UploadError(f"{process.args[0]} exited with status {process.returncode}")
+        if pending:
+            _put(chunks, bytes(pending), stop)
+        _put(chunks, None, stop)
+    except BaseException as exc:
+        _put(chunks, exc, stop)
+
+
+class DriveStream:
+    """One resumable upload session fed chunk by chunk."""
+
+    def __init__(self, get_token, api_url: str = DRIVE_API_URL, retries: int = 8, timeout: float = 120, log=print):
+        self.get_token = get_token
+        self.api_url = api_url.rstrip("/")
+        self.retries = retries
+        self.http = _Http(timeout)
+        self.log = log
+        self.retried = 0
+
+    def _headers(self, extra: dict = None, refresh: bool = False) -> dict:
+        headers = {"Authorization": f"Bearer {self.get_token(refresh)}"}
+        headers.update(extra or {})
+        return headers
+
+    def _request(self, method: str, url: str, body: bytes = b"", headers: dict = None):
+        """Send one request, retrying connection errors and 429/5xx with backoff."""
+        attempt = 0
+        refresh = refreshed = False
+        while True:
+            try:
+                status, response_headers, data = self.http.request(
+                    method, url, body, self._headers(headers, refresh=refresh))
+            except (OSError, http.client.HTTPException) as exc:
+                error = f"{type(exc).__name__}: {exc}"
+            else:
+                # An expired access token gets one immediate retry with a fresh one
+                refresh = status == 401 and not refreshed
+                refreshed = refreshed or refresh
+                if refresh:
+                    continue
+                if status not in RETRY_STATUSES:
+                    return status, response_headers, data
+                error = f"HTTP {status}"
+            if attempt == self.retries:
+                raise UploadError(f"{method} failed after {self.retries} retries: {error}")
+            delay = min(2 ** attempt, 32) + random.random()
+            attempt += 1
+            self.retried += 1
+            self.log(f"{method} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            if method == "PUT" and body:
+                # The chunk may have partly arrived; the caller resends from what Drive reports
+                return self.status(url)
+
+    def start(self, name: str, folder_id: str) -> str:
+        query = urlencode({"uploadType": "resumable", "fields": "id,name,size,md5Checksum"})
+        metadata = {"name": name, "parents": [folder_id], "mimeType": "application/gzip"}
+        status, headers, data = self._request(
+            "POST", f"{self.api_url}/upload/drive/v3/files?{query}", json.dumps(metadata).encode(),
+            {"Content-Type": "application/json; charset=UTF-8", "X-Upload-Content-Type": "application/gzip"})
+        if status != 200 or not headers.get("Location"):
+            raise UploadError(f"Could not start an upload session: HTTP {status} {data[:200]!r}")
+        return headers["Location"]
+
+    @staticmethod
+    def _outcome(status: int, headers, data: bytes):
+        """``(committed_bytes, None)`` while incomplete, ``(None, file)`` once Drive has the whole file."""
+        if status in (200, 201):
+            return None, json.loads(data)
+        if status == 308:
+            committed = headers.get("Range")
+            return (int(committed.rsplit("-", 1)[1]) + 1 if committed else 0), None
+        if status in (404, 410):
+            raise UploadError("The upload session expired; the backup has to be started again")
+        raise UploadError(f"Upload failed: HTTP {status} {data[:200]!r}")
+
+    def status(self, session: str, total: int = None):
+        """Ask Drive how much of the upload it has committed."""
+        return self._request("PUT", session, b"", {"Content-Range": f"bytes */{'*' if total is None else total}"})
+
+    def send(self, session: str, offset: int, body: bytes, total: int = None):
+        end = f"{offset + len(body) - 1}" if body else ""
+        content_range = f"bytes {offset}-{end}/{'*' if total is None else total}" if body else f"bytes */{total}"
+        return self._outcome(*self._request("PUT", session, body, {"Content-Range": content_range}))
+
+    def cancel(self, session: str):
+        try:
+            self.http.request("DELETE", session, b"", self._headers())
+        except (OSError, http.client.HTTPException):
+            pass
+
+    def delete_file(self, file_id: str):
+        self._request("DELETE", f"{self.api_url}/drive/v3/files/{file_id}")
+
+
+def stream_backup(command: list, folder_id: str, name: str, get_token, api_url: str = DRIVE_API_URL,
+                  chunk_size: int = 32 * CHUNK_ALIGN, buffer_chunks: int = 4, level: int = 6,
+                  retries: int = 8, log=print) -> StreamResult:
+    """Run ``command`` and upload its gzipped output to Drive as ``name``.
+
+    ``get_token(refresh)`` returns an OAuth access token, a fresh one when
+    ``refresh`` is true. The upload is cancelled if the command fails, so a
+    truncated dump never shows up as a finished backup.
+    """
+    if chunk_size % CHUNK_ALIGN:
+        raise ValueError(f"chunk_size must be a multiple of {CHUNK_ALIGN}")
+    started = time.perf_counter()
+    drive = DriveStream(get_token, api_url, retries, log=log)
+    session = drive.start(name, folder_id)
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    except OSError:
+        drive.cancel(session)
+        raise
+    chunks = queue.Queue(maxsize=buffer_chunks)
+    stop = threading.Event()
+    stats = {"dump_bytes": 0}
+    compressor = threading.Thread(target=_compress, name="backup-gzip",
+                                  args=(process, chunks, chunk_size, level, stop, stats), daemon=True)
+    compressor.start()
+
+    md5 = hashlib.md5()
+    offset = received = 0  # bytes committed by Drive, bytes taken from the queue
+    buffer = bytearray()  # the bytes from ``offset`` on that Drive does not have yet
+    finished = False
+    uploaded = None
+    stalled = 0
+    try:
+        while uploaded is None:
+            while not finished and len(buffer) < chunk_size:
+                item = chunks.get()
+                if item is None:
+                    finished = True
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    md5.update(item)
+                    buffer += item
+                    received += len(item)
+            if finished:
+                committed, uploaded = drive.send(session, offset, bytes(buffer), total=received)
+            else:
+                committed, uploaded = drive.send(session, offset, bytes(buffer[:chunk_size]))
+            if uploaded is None:
+                if committed < offset:
+                    raise UploadError(f"Drive went back from {offset} to {committed} committed bytes")
+                stalled = stalled + 1 if committed == offset else 0
+                if stalled > retries:
+                    raise UploadError(f"Drive stopped accepting data at {offset} bytes")
+                del buffer[:committed - offset]
+                offset = committed
+    except BaseException:
+        stop.set()
+        process.kill()
+        drive.cancel(session)
+        raise
+    finally:
+        process.wait()
+        drive.http.close()
+
+    checksum = md5.hexdigest()
+    if uploaded.get("md5Checksum") != checksum or int(uploaded.get("size", -1)) != received:
+        drive.delete_file(uploaded["id"])
+        raise UploadError(f"Drive stored {uploaded.get('size')} bytes with MD5 {uploaded.get('md5Checksum')}, "
+                          f"but {received} bytes with MD5 {checksum} were sent; the file was deleted")
+    return StreamResult(uploaded["id"], received, checksum, stats["dump_bytes"], drive.retried,
+                        time.perf_counter() - started)
+
+
+def add_stream_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--stream", action="store_true", help="pipe pg_dump straight to Drive instead of uploading --file")
+    parser.add_argument("--dump-command", default=os.environ.get("BACKUP_DUMP_COMMAND"),
+                        help="command whose output is backed up (default: pg_dump of $DATABASE_URL)")
+    parser.add_argument("--chunk-mb", type=int, default=8, help="upload chunk size in MiB")
+    parser.add_argument("--buffer-chunks", type=int, default=4, help="compressed chunks held in memory")
+    parser.add_argument("--level", type=int, default=6, help="gzip compression level")
+    parser.add_argument("--api-url", default=os.environ.get("GDRIVE_API_URL", DRIVE_API_URL))
+
+
+def stream_from_args(args, get_token) -> StreamResult:
+    if args.dump_command:
+        command = shlex.split(args.dump_command)
+    else:
+        database_url = os.environ.get("DATABASE_URL")
+        if not database_url:
+            raise RuntimeError("Missing DATABASE_URL")
+        command = pg_dump_command(database_url)
+    result = stream_backup(command, args.folder, args.name, get_token, api_url=args.api_url,
+                           chunk_size=args.chunk_mb * 4 * CHUNK_ALIGN, buffer_chunks=args.buffer_chunks,
+                           level=args.level)
+    print(f"Uploaded {args.name} ({result.file_id}): {result.dump_bytes} dump bytes -> {result.size} gzipped, "
+          f"md5 {result.md5}, {result.retries} retried request(s), {result.seconds:.1f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token", default=os.environ.get("GDRIVE_ACCESS_TOKEN"), help="OAuth access token")
+    parser.add_argument("--folder", default=os.environ.get("GDRIVE_FOLDER_ID"))
+    parser.add_argument("--name", required=True)
+    add_stream_arguments(parser)
+    args = parser.parse_args()
+    if not args.token:
+        raise RuntimeError("Missing GDRIVE_ACCESS_TOKEN")
+    if not args.folder:
+        raise RuntimeError("Missing GDRIVE_FOLDER_ID")
+    stream_from_args(args, lambda refresh=False: args.token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Local stand-in for the Drive resumable upload API, for testing streamed backups offline.
+
+    python tools/fake_drive.py --port 8080 [--dir /tmp/drive] [--fail-rate 0.1]
+
+Point the backup at it with --api-url http://localhost:8080 (or GDRIVE_API_URL)
+and any access token. Finished uploads are written to ``--dir`` and served back
+by ``GET /drive/v3/files/<id>?alt=media`` so a restore can be checked.
+``--fail-rate`` makes a share of chunk uploads fail: half of them answer 503
+without keeping anything, the others keep part of the chunk and drop the
+connection without answering, like a response lost on the way back.
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+CHUNK_ALIGN = 256 * 1024
+RANGE_RE = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$')
+
+
+class Upload:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.committed = 0
+        self.md5 = hashlib.md5()
+        self.lock = threading.Lock()
+
+    def append(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self.md5.update(data)
+        self.committed += len(data)
+
+
+class DriveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self.reply(401, {'error': 'missing bearer token'})
+            return False
+        return True
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def route(self):
+        parts = urlsplit(self.path)
+        return parts.path, {key: values[0] for key, values in parse_qs(parts.query).items()}
+
+    def do_POST(self):
+        path, query = self.route()
+        metadata = json.loads(self.body() or b'{}')
+        if not self.authorized():
+            return
+        if path != '/upload/drive/v3/files' or query.get('uploadType') != 'resumable':
+            return self.reply(404, {'error': 'not found'})
+        upload_id = uuid.uuid4().hex
+        self.server.uploads[upload_id] = Upload(metadata.get('name', upload_id), os.path.join(self.server.dir, upload_id))
+        location = f"http://{self.headers['Host']}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+        self.reply(200, headers={'Location': location})
+
+    def do_PUT(self):
+        path, query = self.route()
+        data = self.body()
+        if not self.authorized():
+            return
+        upload = self.server.uploads.get(query.get('upload_id'))
+        if upload is None:
+            return self.reply(404, {'error': 'upload session not found'})
+        match = RANGE_RE.match(self.headers.get('Content-Range', ''))
+        if not match:
+            return self.reply(400, {'error': 'bad Content-Range'})
+        start, total = match.group(1), match.group(3)
+        total = None if total == '*' else int(total)
+        with upload.lock:
+            if start is not None:
+                if int(start) != upload.committed or int(match.group(2)) - int(start) + 1 != len(data):
+                    return self.reply(400, {'error': f'expected a chunk starting at {upload.committed}'})
+                final = total is not None and upload.committed + len(data) == total
+                if not final and len(data) % CHUNK_ALIGN:
+                    return self.reply(400, {'error': f'chunks must be multiples of {CHUNK_ALIGN} bytes'})
+                if random.random() < self.server.fail_rate:
+                    self.server.failures += 1
+                    if random.random() < 0.5:
+                        return self.reply(503, {'error': 'backend error'})
+                    upload.append(data[:len(data) // 2 // CHUNK_ALIGN * CHUNK_ALIGN])
+                    self.close_connection = True
+                    return
+                upload.append(data)
+            if total is not None and upload.committed == total:
+                return self.finish_upload(query['upload_id'], upload)
+            headers = {'Range': f'bytes=0-{upload.committed - 1}'} if upload.committed else {}
+            self.reply(308, headers=headers)
+
+    def finish_upload(self, upload_id, upload):
+        del self.server.uploads[upload_id]
+        resource = {'id': upload_id, 'name': upload.name, 'size': str(upload.committed),
+                    'md5Checksum': upload.md5.hexdigest()}
+        self.server.files[upload_id] = resource
+        print(f"Stored {upload.name}: {upload.committed} bytes, md5 {resource['md5Checksum']}, "
+              f"{self.server.failures} injected failure(s) so far", flush=True)
+        self.reply(200, resource)
+
+    def do_GET(self):
+        path, query = self.route()
+        if not self.authorized():
+            return
+        resource = self.server.files.get(path.rsplit('/', 1)[-1]) if path.startswith('/drive/v3/files/') else None
+        if resource is None:
+            return self.reply(404, {'error': 'file not found'})
+        if query.get('alt') != 'media':
+            return self.reply(200, resource)
+        with open(os.path.join(self.server.dir, resource['id']), 'rb') as f:
+            self.reply(200, f.read(), {'Content-Type': 'application/octet-stream'})
+
+    def do_DELETE(self):
+        path, query = self.route()
+        if not self.authorized():
+            return
+        upload = self.server.uploads.pop(query.get('upload_id'), None) if path == '/upload/drive/v3/files' else None
+        if upload is not None:
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
+            print(f'Cancelled {upload.name} after {upload.committed} bytes', flush=True)
+            return self.reply(499)
+        file_id = path.rsplit('/', 1)[-1]
+        if path.startswith('/drive/v3/files/') and self.server.files.pop(file_id, None):
+            os.remove(os.path.join(self.server.dir, file_id))
+            return self.reply(204)
+        self.reply(404, {'error': 'not found'})
+
+
+class FakeDriveServer(http.server.ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--dir', help='where uploads are kept (default: a temporary directory)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of chunk uploads that fail')
+    args = parser.parse_args()
+
+    server = FakeDriveServer((args.host, args.port), DriveHandler)
+    server.dir = args.dir or tempfile.mkdtemp(prefix='fake-drive-')
+    os.makedirs(server.dir, exist_ok=True)
+    server.uploads = {}
+    server.files = {}
+    server.fail_rate = args.fail_rate
+    server.failures = 0
+    print(f'Fake Drive listening on http://{args.host}:{args.port}, storing uploads in {server.dir}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
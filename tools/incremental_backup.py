@@ -0,0 +1,370 @@
+"""Deduplicating incremental backups: content-defined chunks plus a manifest per snapshot.
+
+    python tools/incremental_backup.py backup --prefix render-postgres-backup-
+    python tools/incremental_backup.py list --prefix render-postgres-backup-
+    python tools/incremental_backup.py restore latest --prefix render-postgres-backup- | pg_restore ...
+    python tools/incremental_backup.py prune --prefix render-postgres-backup- --keep-last 30
+
+The dump is cut at content-defined points, so rows inserted, updated or
+deleted in one table only change the chunks around them. Each chunk is
+stored once, gzipped, as ``chunk-<sha256>.gz``; a snapshot is a small
+``<prefix><timestamp>.manifest.json`` listing its chunks in order. A
+backup uploads only the chunks the store does not have yet, and pruning
+deletes a chunk once no kept manifest refers to it.
+
+Chunks live in the Drive folder (``--auth oauth`` or ``service-account``,
+configured like the other backup scripts) or, with ``--store DIR``, in a
+local directory, which is what tools/bench_dedupe.py uses. Pruning assumes
+no backup is running at the same time: chunks of an unfinished snapshot
+have no manifest yet and would be removed.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+import zlib
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+
+from drive_stream import pg_dump_command
+
+CHUNK_PREFIX = "chunk-"
+MANIFEST_SUFFIX = ".manifest.json"
+FORMAT = 1
+READ_SIZE = 1024 * 1024
+# Bytes hashed before a candidate cut point
+WINDOW = 64
+
+AVERAGE = 1024 * 1024
+MINIMUM = 256 * 1024
+MAXIMUM = 4 * 1024 * 1024
+
+BackupResult = namedtuple("BackupResult", "snapshot size chunks new_chunks new_bytes seconds")
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+def _cut_point(buffer: bytearray, minimum: int, limit: int, rate: int):
+    """End of the first chunk in ``buffer`` or None if there is no cut point before ``limit``.
+
+    Only line ends are candidates: pg_dump writes table data as COPY
+    rows, so they are frequent, and ``find`` locates them at C speed
+    where a per-byte rolling hash in Python would not. A candidate is
+    taken when a hash of the ``WINDOW`` bytes before it falls under a
+    threshold proportional to the length of its line, so on average
+    ``rate`` bytes go by between cuts whatever the row size. The choice
+    depends only on nearby content, which is what lets an insert early in
+    the dump leave every later cut point where it was.
+    """
+    threshold = 1 << 32
+    with memoryview(buffer) as view:
+        position = buffer.find(b"\n", minimum - 1, limit)
+        previous = buffer.rfind(b"\n", 0, position) if position >= 0 else -1
+        while position >= 0:
+            end = position + 1
+            gap = min(position - previous, rate)
+            if zlib.crc32(view[end - WINDOW:end]) * rate < gap * threshold:
+                return end
+            previous = position
+            position = buffer.find(b"\n", end, limit)
+    return None
+
+
+def split(stream, average: int = AVERAGE, minimum: int = MINIMUM, maximum: int = MAXIMUM):
+    """Yield content-defined chunks of a binary stream.
+
+    Chunks are at least ``minimum`` bytes (except the last), about
+    ``average`` bytes on average and cut at ``maximum`` when the data has
+    no line ends, e.g. inside large binary sections.
+    """
+    if not WINDOW <= minimum < average < maximum:
+        raise ValueError("chunk sizes must satisfy WINDOW <= minimum < average < maximum")
+    rate = average - minimum
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < maximum:
+            block = stream.read(READ_SIZE)
+            eof = not block
+            buffer += block
+        if not buffer:
+            return
+        end = _cut_point(buffer, minimum, maximum, rate) if len(buffer) > minimum else None
+        if end is None:
+            end = min(len(buffer), maximum)
+        yield bytes(buffer[:end])
+        del buffer[:end]
+
+
+def chunk_name(digest: str) -> str:
+    return f"{CHUNK_PREFIX}{digest}.gz"
+
+
+def manifest_name(prefix: str, snapshot: str = None) -> str:
+    snapshot = snapshot or datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    return snapshot if snapshot.endswith(MANIFEST_SUFFIX) else f"{prefix}{snapshot}{MANIFEST_SUFFIX}"
+
+
+class LocalStore:
+    """Chunks and manifests as files in one directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def list(self, prefix: str) -> list:
+        return sorted(name for name in os.listdir(self.directory) if name.startswith(prefix))
+
+    def put(self, name: str, data: bytes):
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def get(self, name: str) -> bytes:
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+    def delete(self, name: str):
+        os.remove(os.path.join(self.directory, name))
+
+
+class DriveStore:
+    """Chunks and manifests as files in one Drive folder."""
+
+    def __init__(self, service, folder_id: str):
+        self.service = service
+        self.folder_id = folder_id
+        self.ids = {}
+
+    def list(self, prefix: str) -> list:
+        q = f"'{self.folder_id}' in parents and trashed=false"
+        if prefix:
+            q += f" and name contains '{prefix}'"
+        page_token = None
+        while True:
+            resp = (
+                self.service.files()
+                .list(q=q, spaces="drive", fields="nextPageToken, files(id,name)", pageSize=1000, pageToken=page_token)
+                .execute()
+            )
+            for f in resp.get("files", []):
+                self.ids[f["name"]] = f["id"]
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+        return sorted(name for name in self.ids if name.startswith(prefix))
+
+    def _id(self, name: str) -> str:
+        if name not in self.ids:
+            self.list(name)
+        if name not in self.ids:
+            raise BackupError(f"{name} is not in the backup folder")
+        return self.ids[name]
+
+    def put(self, name: str, data: bytes):
+        from googleapiclient.http import MediaIoBaseUpload
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype="application/octet-stream", resumable=False)
+        created = (
+            self.service.files()
+            .create(body={"name": name, "parents": [self.folder_id]}, media_body=media, fields="id")
+            .execute()
+        )
+        self.ids[name] = created["id"]
+
+    def get(self, name: str) -> bytes:
+        return self.service.files().get_media(fileId=self._id(name)).execute()
+
+    def delete(self, name: str):
+        self.service.files().delete(fileId=self._id(name)).execute()
+        del self.ids[name]
+
+
+def backup(store, stream, prefix: str, average: int = AVERAGE, minimum: int = MINIMUM, maximum: int = MAXIMUM,
+           level: int = 6, snapshot: str = None, check=None) -> BackupResult:
+    """Store a new snapshot of ``stream``, uploading only chunks the store lacks.
+
+    ``check`` is called once the stream is exhausted and may raise to
+    abort. The manifest is written last, so a backup that fails halfway
+    leaves only unreferenced chunks, which the next prune removes.
+    """
+    started = time.perf_counter()
+    known = set(store.list(CHUNK_PREFIX))
+    total = hashlib.sha256()
+    chunks = []
+    size = new_chunks = new_bytes = 0
+    for data in split(stream, average, minimum, maximum):
+        digest = hashlib.sha256(data).hexdigest()
+        name = chunk_name(digest)
+        if name not in known:
+            compressed = zlib.compress(data, level, wbits=31)
+            store.put(name, compressed)
+            known.add(name)
+            new_chunks += 1
+            new_bytes += len(compressed)
+        total.update(data)
+        size += len(data)
+        chunks.append([digest, len(data)])
+    if check:
+        check()
+    name = manifest_name(prefix, snapshot)
+    manifest = {"format": FORMAT, "created": datetime.now(timezone.utc).isoformat(), "size": size,
+                "sha256": total.hexdigest(), "chunks": chunks}
+    store.put(name, json.dumps(manifest, separators=(",", ":")).encode())
+    return BackupResult(name, size, len(chunks), new_chunks, new_bytes, time.perf_counter() - started)
+
+
+def snapshots(store, prefix: str) -> list:
+    """Manifest names, oldest first (timestamps in the names sort in time order)."""
+    return [name for name in store.list(prefix) if name.endswith(MANIFEST_SUFFIX)]
+
+
+def read_manifest(store, name: str) -> dict:
+    manifest = json.loads(store.get(name))
+    if manifest.get("format") != FORMAT:
+        raise BackupError(f"{name} has unknown format {manifest.get('format')!r}")
+    return manifest
+
+
+def restore(store, name: str, out) -> int:
+    """Write the snapshot in manifest ``name`` to ``out``, verifying every chunk; returns its size."""
+    manifest = read_manifest(store, name)
+    total = hashlib.sha256()
+    for digest, size in manifest["chunks"]:
+        data = zlib.decompress(store.get(chunk_name(digest)), wbits=31)
+        if len(data) != size or hashlib.sha256(data).hexdigest() != digest:
+            raise BackupError(f"Chunk {digest} is corrupt")
+        out.write(data)
+        total.update(data)
+    if total.hexdigest() != manifest["sha256"]:
+        raise BackupError(f"{name} does not match its checksum")
+    return manifest["size"]
+
+
+def prune(store, prefix: str, keep_last: int):
+    """Keep the newest ``keep_last`` snapshots under ``prefix`` and delete chunks no snapshot uses.
+
+    Chunks are shared by every prefix in the store, so references are
+    counted over all manifests, not only this prefix's. Every manifest adds
+    one reference to each chunk it lists; a chunk is deleted when its count
+    drops to zero, including chunks left behind by a failed backup.
+    Returns ``(snapshots_deleted, chunks_deleted)``.
+    """
+    if keep_last <= 0:
+        return 0, 0
+    references = Counter()
+    manifests = {}
+    for name in snapshots(store, ""):
+        manifests[name] = {digest for digest, _ in read_manifest(store, name)["chunks"]}
+        references.update(manifests[name])
+    dropped = snapshots(store, prefix)[:-keep_last]
+    for name in dropped:
+        store.delete(name)
+        references.subtract(manifests[name])
+    deleted = 0
+    for name in store.list(CHUNK_PREFIX):
+        if references[name[len(CHUNK_PREFIX):-len(".gz")]] <= 0:
+            store.delete(name)
+            deleted += 1
+    return len(dropped), deleted
+
+
+def _open_store(args):
+    if args.store:
+        return LocalStore(args.store)
+    if not args.folder:
+        raise RuntimeError("Missing GDRIVE_FOLDER_ID")
+    if args.auth == "service-account":
+        from drive_backup import build_credentials, build_drive_service
+    else:
+        from drive_backup_oauth import build_credentials, build_drive_service
+    return DriveStore(build_drive_service(build_credentials()), args.folder)
+
+
+def _resolve(store, prefix: str, snapshot: str) -> str:
+    names = snapshots(store, prefix)
+    if snapshot == "latest":
+        if not names:
+            raise BackupError("There are no snapshots yet")
+        return names[-1]
+    name = manifest_name(prefix, snapshot)
+    if name not in names:
+        raise BackupError(f"No snapshot {name}")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default=os.environ.get("GDRIVE_FOLDER_ID"))
+    parser.add_argument("--auth", choices=("oauth", "service-account"), default="oauth")
+    parser.add_argument("--store", help="use a local directory instead of Drive")
+    parser.add_argument("--prefix", required=True, help="snapshot name prefix, e.g. render-postgres-backup-")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backup_parser = commands.add_parser("backup", help="dump the database and store a new snapshot")
+    backup_parser.add_argument("--dump-command", default=os.environ.get("BACKUP_DUMP_COMMAND"),
+                               help="command whose output is backed up (default: pg_dump of $DATABASE_URL)")
+    backup_parser.add_argument("--average-kb", type=int, default=AVERAGE // 1024)
+    backup_parser.add_argument("--keep-last", type=int, default=int(os.environ.get("GDRIVE_KEEP_LAST", "30")),
+                               help="prune afterwards, keeping this many snapshots (0 keeps all)")
+
+    commands.add_parser("list", help="show the stored snapshots")
+
+    restore_parser = commands.add_parser("restore", help="write a snapshot's dump to stdout or --output")
+    restore_parser.add_argument("snapshot", help='"latest", a timestamp or a manifest name')
+    restore_parser.add_argument("--output", default="-")
+
+    prune_parser = commands.add_parser("prune", help="delete old snapshots and the chunks only they used")
+    prune_parser.add_argument("--keep-last", type=int, default=int(os.environ.get("GDRIVE_KEEP_LAST", "30")))
+    args = parser.parse_args()
+
+    store = _open_store(args)
+    if args.command == "backup":
+        if args.dump_command:
+            command = shlex.split(args.dump_command)
+        elif os.environ.get("DATABASE_URL"):
+            command = pg_dump_command(os.environ["DATABASE_URL"])
+        else:
+            raise RuntimeError("Missing DATABASE_URL")
+        average = args.average_kb * 1024
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+        def check():
+            if process.wait() != 0:
+                raise BackupError(f"{command[0]} exited with status {process.returncode}; no snapshot was written")
+
+        try:
+            result = backup(store, process.stdout, args.prefix, average, average // 4, average * 4, check=check)
+        finally:
+            process.kill()
+            process.wait()
+        print(f"Stored {result.snapshot}: {result.size} bytes in {result.chunks} chunks, "
+              f"{result.new_chunks} new ({result.new_bytes} bytes uploaded), {result.seconds:.1f}s")
+        snapshots_deleted, chunks_deleted = prune(store, args.prefix, args.keep_last)
+        print(f"Pruned {snapshots_deleted} snapshot(s) and {chunks_deleted} chunk(s)")
+    elif args.command == "list":
+        for name in snapshots(store, args.prefix):
+            manifest = read_manifest(store, name)
+            print(f"{name}  {manifest['size']:>14} bytes  {len(manifest['chunks']):>6} chunks")
+    elif args.command == "restore":
+        name = _resolve(store, args.prefix, args.snapshot)
+        if args.output == "-":
+            size = restore(store, name, sys.stdout.buffer)
+        else:
+            with open(args.output, "wb") as out:
+                size = restore(store, name, out)
+        print(f"Restored {name}: {size} bytes", file=sys.stderr)
+    elif args.command == "prune":
+        snapshots_deleted, chunks_deleted = prune(store, args.prefix, args.keep_last)
+        print(f"Pruned {snapshots_deleted} snapshot(s) and {chunks_deleted} chunk(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Local SMTP server that accepts and discards mail, for testing the outbox offline.
+
+    python tools/smtp_sink.py --port 8025 [--delay 0.2] [--fail-rate 0.1]
+
+Point the app at it with MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=false
+plus any MAIL_USERNAME/MAIL_PASSWORD (AUTH is accepted but not checked). It
+prints the delivery rate every few seconds. ``--delay`` slows each message down
+like a distant server; ``--fail-rate`` rejects a share of messages with 451 so
+retries can be exercised.
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.rejected = 0
+        self.connections = 0
+
+    def add(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        server.stats.add('connections')
+        self.reply('220 smtp-sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-smtp-sink')
+                self.reply('250-AUTH PLAIN LOGIN')
+                self.reply('250 8BITMIME')
+            elif verb == 'AUTH':
+                self.reply('235 Authentication successful')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if server.delay:
+                    time.sleep(server.delay)
+                if random.random() < server.fail_rate:
+                    server.stats.add('rejected')
+                    self.reply('451 Temporary failure, try again later')
+                else:
+                    server.stats.add('messages')
+                    self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif verb in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def report(stats, interval):
+    last = 0
+    while True:
+        time.sleep(interval)
+        with stats.lock:
+            messages, rejected, connections = stats.messages, stats.rejected, stats.connections
+        print(f'{messages} accepted ({(messages - last) / interval:.1f}/s), '
+              f'{rejected} rejected, {connections} connection(s)', flush=True)
+        last = messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before accepting each message')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of messages to reject with 451')
+    parser.add_argument('--report-every', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = SinkServer((args.host, args.port), SMTPHandler)
+    server.stats = Stats()
+    server.delay = args.delay
+    server.fail_rate = args.fail_rate
+    threading.Thread(target=report, args=(server.stats, args.report_every), daemon=True).start()
+    print(f'SMTP sink listening on {args.host}:{args.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()